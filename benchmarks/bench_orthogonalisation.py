@@ -0,0 +1,44 @@
+# bench_orthogonalisation.py
+#
+# Times rendering a first level design with 200 EVs and a dense orthogonalisation matrix.
+# Run from the repository root: python -m benchmarks.bench_orthogonalisation
+
+import os
+import tempfile
+import timeit
+import nibabel as nib
+import numpy as np
+from make_fsf import feat_functions
+
+N_EVS = 200
+REPEATS = 20
+
+with tempfile.TemporaryDirectory() as tmp:
+    input_file = os.path.join(tmp, "bold.nii.gz")
+    nib.save(nib.Nifti1Image(np.zeros((4, 4, 4, 10), dtype=np.float32), np.eye(4)), input_file)
+
+    ev_files = []
+    for i in range(N_EVS):
+        ev_file = os.path.join(tmp, f"ev{i + 1}.txt")
+        np.savetxt(ev_file, [[i, 1, 1]])
+        ev_files.append(ev_file)
+    ev_names = [f"EV{i + 1}" for i in range(N_EVS)]
+    contrasts = {"EV1": [1] + [0] * (N_EVS - 1)}
+
+    # Every EV orthogonalised with respect to every earlier one (acyclic, and the densest such case)
+    orthogonalise = np.tril(np.ones((N_EVS, N_EVS), dtype=bool), k=-1)
+
+    def render(orthogonalise):
+        return feat_functions.render_lowlvl_fsf(tmp, input_file, tmp, None, 2.0, 10, ev_files, ev_names,
+                                                contrasts, None, orthogonalise=orthogonalise)
+
+    render(None)
+    plain = min(timeit.repeat(lambda: render(None), number=1, repeat=REPEATS))
+    ortho = min(timeit.repeat(lambda: render(orthogonalise), number=1, repeat=REPEATS))
+    blocks = min(timeit.repeat(lambda: feat_functions._ortho_blocks(feat_functions._ortho_matrix(orthogonalise, ev_names)),
+                               number=1, repeat=REPEATS))
+
+    print(f"{N_EVS} EVs, {N_EVS * (N_EVS + 1)} ortho entries, {len(render(orthogonalise)) / 1e6:.1f} MB of .fsf")
+    print(f"render without orthogonalisation: {plain * 1e3:.1f} ms")
+    print(f"render with orthogonalisation:    {ortho * 1e3:.1f} ms")
+    print(f"validate + format ortho block:    {blocks * 1e3:.1f} ms")
@@ -1,4 +1,12 @@
 # __init__.py
 
-import .feat_functions
-import .utilities
\ No newline at end of file
+from . import feat_functions
+from . import utilities
+from . import bids
+from . import sweep
+from . import watch
+from . import status
+from . import bundle
+from . import aio
+from . import beta_series
+from . import archives
@@ -0,0 +1,196 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from . import feat_functions
+from . import utilities
+
+# Threads shared by every coroutine here, so blocking I/O never runs on the event loop
+_EXECUTOR = None
+MAX_WORKERS = 8
+
+# ----- _get_executor -----
+def _get_executor(executor=None):
+    """
+    Returns the executor to offload blocking work to, creating the shared one on first use.
+
+    Parameters:
+    executor (concurrent.futures.Executor): An executor to use instead. Default is None.
+
+    Returns:
+    concurrent.futures.Executor: The executor.
+    """
+    global _EXECUTOR
+    if executor is not None:
+        return executor
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="make_fsf")
+    return _EXECUTOR
+
+# ----- _run_serially -----
+def _run_serially(function, *args, **kwargs):
+    """
+    Runs a function on an executor thread without letting it start threads of its own, so the pool stays the bound.
+
+    Parameters:
+    function (callable): The function to run.
+
+    Returns:
+    The function's return value.
+    """
+    utilities._SERIAL.active = True
+    try:
+        return function(*args, **kwargs)
+    finally:
+        utilities._SERIAL.active = False
+
+# ----- _offload -----
+async def _offload(executor, function, *args, **kwargs):
+    """
+    Runs a blocking function in an executor and waits for it without blocking the event loop.
+
+    Parameters:
+    executor (concurrent.futures.Executor): The executor, or None for the shared one.
+    function (callable): The function to run.
+
+    Returns:
+    The function's return value.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(executor),
+                                      functools.partial(_run_serially, function, *args, **kwargs))
+
+# ----- probe_nifti_async -----
+async def probe_nifti_async(input_file, detect_dummies=False, executor=None):
+    """
+    Asynchronous counterpart of utilities.probe_nifti.
+
+    Parameters:
+    input_file (str): The path to the .nii.gz file.
+    detect_dummies (bool): Whether to also count dummy volumes. Default is False.
+    executor (concurrent.futures.Executor): The executor to offload to. Default is None, which uses a shared pool of MAX_WORKERS threads.
+
+    Returns:
+    dict: "file", "tr", "volumes", "voxels" and "dummies".
+    """
+    return await _offload(executor, utilities.probe_nifti, input_file, detect_dummies)
+
+# ----- render_lowlvl_fsf_async -----
+async def render_lowlvl_fsf_async(executor=None, **job):
+    """
+    Asynchronous counterpart of feat_functions.render_lowlvl_fsf.
+
+    Parameters:
+    executor (concurrent.futures.Executor): The executor to offload to. Default is None.
+    **job: The lowlvl_fsf keyword arguments.
+
+    Returns:
+    str: The .fsf file contents.
+    """
+    return await _offload(executor, feat_functions.render_lowlvl_fsf, **job)
+
+# ----- _write_design -----
+def _write_design(fsf_dir, fsf_content):
+    """
+    Writes design.fsf into a directory.
+
+    Parameters:
+    fsf_dir (str): The directory to write to.
+    fsf_content (str): The .fsf file contents.
+
+    Returns:
+    str: The path of the written file.
+    """
+    utilities.check_directory_exists(fsf_dir)
+    design_file = os.path.join(fsf_dir, "design.fsf")
+    with open(design_file, "w") as file:
+        file.write(fsf_content)
+    return design_file
+
+# ----- write_fsf_async -----
+async def write_fsf_async(fsf_dir, fsf_content, executor=None):
+    """
+    Writes design.fsf into a directory without blocking the event loop.
+
+    Parameters:
+    fsf_dir (str): The directory to write to.
+    fsf_content (str): The .fsf file contents.
+    executor (concurrent.futures.Executor): The executor to offload to. Default is None.
+
+    Returns:
+    str: The path of the written file.
+    """
+    return await _offload(executor, _write_design, fsf_dir, fsf_content)
+
+# ----- lowlvl_fsf_async -----
+async def lowlvl_fsf_async(executor=None, **job):
+    """
+    Asynchronous counterpart of feat_functions.lowlvl_fsf.
+
+    Parameters:
+    executor (concurrent.futures.Executor): The executor to offload to. Default is None.
+    **job: The lowlvl_fsf keyword arguments.
+
+    Returns:
+    str: The path of the written design.fsf.
+
+    Example:
+    design_file = await lowlvl_fsf_async(**job)
+    """
+    fsf_content = await render_lowlvl_fsf_async(executor, **job)
+    return await write_fsf_async(job["fsf_dir"], fsf_content, executor)
+
+# ----- generate_fsf_async -----
+async def generate_fsf_async(jobs, max_concurrency=MAX_WORKERS, executor=None):
+    """
+    Generates many first level designs concurrently, yielding each as soon as it finishes.
+
+    Jobs are pulled from the iterable one at a time in the executor, so a lazy source such as
+    bids.bids_jobs never scans the dataset on the event loop, and at most max_concurrency jobs
+    are in flight at once; a new one starts as each finishes. If the consumer stops iterating
+    (or is cancelled), jobs that have not finished are cancelled.
+
+    Parameters:
+    jobs (iterable): Dictionaries of lowlvl_fsf keyword arguments (e.g., from bids.bids_jobs).
+    max_concurrency (int): The largest number of jobs in flight. Default is MAX_WORKERS.
+    executor (concurrent.futures.Executor): The executor to offload to. Default is None.
+
+    Returns:
+    async generator: (job, result) tuples in completion order, where result is the path of the
+                     written design.fsf or the exception the job raised.
+
+    Example:
+    async for job, result in generate_fsf_async(jobs):
+        if isinstance(result, Exception):
+            print(f"{job['fsf_dir']} failed: {result}")
+    """
+    async def run(job):
+        try:
+            return job, await lowlvl_fsf_async(executor, **job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return job, e
+
+    iterator = iter(jobs)
+    end = object()
+    exhausted = False
+    running = set()
+    try:
+        while True:
+            # Topping up to max_concurrency jobs, taking each from the iterable off the event loop
+            while not exhausted and len(running) < max_concurrency:
+                job = await _offload(executor, next, iterator, end)
+                if job is end:
+                    exhausted = True
+                else:
+                    running.add(asyncio.ensure_future(run(job)))
+            if not running:
+                break
+
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in running:
+            task.cancel()
@@ -0,0 +1,323 @@
+import bz2
+import functools
+import gzip
+import io
+import lzma
+import os
+import posixpath
+import struct
+import tarfile
+import zipfile
+import zlib
+import nibabel as nib
+
+# Separates an archive from the member inside it, e.g. "sub-01.tar.gz::sub-01/func/sub-01_bold.nii.gz"
+ARCHIVE_SEPARATOR = "::"
+
+# Enough bytes for a NIfTI-2 header (NIfTI-1 needs 348)
+HEADER_BYTES = 540
+
+# JSON members up to this size (e.g., BIDS sidecars) are kept whole while indexing
+SIDECAR_BYTES = 1 << 20
+
+# Magic numbers of the compressed streams a tar file may be wrapped in
+_STREAM_OPENERS = [(b"\x1f\x8b", gzip.open), (b"BZh", bz2.open), (b"\xfd7zXZ\x00", lzma.open)]
+
+# ----- _normalise_member -----
+def _normalise_member(name):
+    """
+    Normalises an archive member name, so "./ds/bold.nii.gz", "/ds/bold.nii.gz" and "ds/bold.nii.gz" match.
+
+    Parameters:
+    name (str): The member name, as written in the archive or given in a path.
+
+    Returns:
+    str: The normalised name ("" for the top level).
+    """
+    name = posixpath.normpath(name.lstrip("/"))
+    return "" if name == "." else name
+
+# ----- split_archive_path -----
+def split_archive_path(path):
+    """
+    Splits an archive-member path into the archive and the member.
+
+    Parameters:
+    path (str): A path such as "sub-01.tar::sub-01/func/sub-01_task-x_bold.nii.gz".
+
+    Returns:
+    tuple: (archive, member), or None if the path does not point inside an archive.
+    """
+    if not isinstance(path, str) or ARCHIVE_SEPARATOR not in path:
+        return None
+    archive, member = path.split(ARCHIVE_SEPARATOR, 1)
+    return archive, _normalise_member(member)
+
+# ----- extracted_path -----
+def extracted_path(path, extract_dir=None):
+    """
+    Returns where an archive member will live once the archive is unpacked.
+
+    Parameters:
+    path (str): An archive-member path (other paths are returned unchanged).
+    extract_dir (str): The directory the archive will be unpacked into. Default is None, which is the archive's own directory.
+
+    Returns:
+    str: The path of the unpacked member.
+    """
+    parts = split_archive_path(path)
+    if parts is None:
+        return path
+    archive, member = parts
+    if extract_dir is None:
+        extract_dir = os.path.dirname(archive)
+    return os.path.join(extract_dir, member)
+
+# ----- _stream_opener -----
+def _stream_opener(archive):
+    """
+    Finds how to open the (possibly compressed) byte stream of an archive.
+
+    Parameters:
+    archive (str): The path to the archive.
+
+    Returns:
+    callable: A function opening the archive's uncompressed stream for binary reading.
+    """
+    with open(archive, "rb") as file:
+        magic = file.read(6)
+    for prefix, opener in _STREAM_OPENERS:
+        if magic.startswith(prefix):
+            return opener
+    return open
+
+# ----- _read_prefix -----
+def _read_prefix(file, n_bytes, gzipped=False, chunk_size=4096):
+    """
+    Reads the first bytes of a file object, decompressing a gzip stream only as far as needed.
+
+    Parameters:
+    file (file object): The file object, positioned at the start of the data.
+    n_bytes (int): The number of bytes to read.
+    gzipped (bool): Whether the data is a gzip stream (e.g., a .nii.gz). Default is False.
+    chunk_size (int): The number of compressed bytes to read at a time. Default is 4096.
+
+    Returns:
+    bytes: Up to n_bytes of uncompressed content.
+    """
+    if not gzipped:
+        return file.read(n_bytes)
+
+    # wbits of 16 + MAX_WBITS expects a gzip wrapper, as in .nii.gz
+    gunzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = b""
+    while len(data) < n_bytes:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        data += gunzip.decompress(chunk, n_bytes - len(data))
+    return data[:n_bytes]
+
+# ----- _capture_length -----
+def _capture_length(name, size):
+    """
+    Decides how much of a member to keep while indexing, so later reads need not reopen the archive.
+
+    Parameters:
+    name (str): The member name.
+    size (int): The member's uncompressed size.
+
+    Returns:
+    int: The number of leading bytes to keep (0 for none).
+    """
+    if name.endswith((".nii", ".nii.gz")):
+        return HEADER_BYTES
+    if name.endswith(".json") and size <= SIDECAR_BYTES:
+        return size
+    return 0
+
+# ----- _member_index -----
+@functools.lru_cache(maxsize=64)
+def _member_index(archive, stamp):
+    """
+    Lists where each member's data starts inside an archive; cached per archive version.
+
+    The archive is read once: NIfTI headers and JSON sidecars are captured during the same
+    pass, so probing a member of a compressed tar never decompresses the stream again.
+
+    Parameters:
+    archive (str): The path to the .tar(.gz/.bz2/.xz) or .zip archive.
+    stamp (tuple): The archive's (mtime_ns, size), so a changed archive is indexed again.
+
+    Returns:
+    dict: Normalised member names mapped to (offset, size, compression, prefix), where the offset is into the
+          uncompressed tar stream or the zip file, compression is a zipfile constant (0 for tar)
+          and prefix holds the member's captured leading bytes (or None).
+    """
+    index = {}
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zip_file, open(archive, "rb") as file:
+            for info in zip_file.infolist():
+                # The local header's name and extra field lengths can differ from the central directory's
+                file.seek(info.header_offset)
+                local = file.read(30)
+                name_length, extra_length = struct.unpack("<HH", local[26:30])
+                offset = info.header_offset + 30 + name_length + extra_length
+
+                prefix = None
+                n_bytes = 0 if info.is_dir() else _capture_length(info.filename, info.file_size)
+                if n_bytes and info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                    with zip_file.open(info) as member:
+                        prefix = _read_prefix(member, n_bytes, info.filename.endswith(".gz"))
+                index[_normalise_member(info.filename)] = (offset, info.compress_size, info.compress_type, prefix)
+    else:
+        # Members are read as the tar stream passes them, so the stream only ever moves forward
+        with tarfile.open(archive, "r:*") as tar_file:
+            for info in tar_file:
+                if not info.isfile():
+                    continue
+                prefix = None
+                n_bytes = _capture_length(info.name, info.size)
+                if n_bytes:
+                    prefix = _read_prefix(tar_file.extractfile(info), n_bytes, info.name.endswith(".gz"))
+                index[_normalise_member(info.name)] = (info.offset_data, info.size, zipfile.ZIP_STORED, prefix)
+    return index
+
+# ----- member_index -----
+def member_index(archive):
+    """
+    Lists the members of an archive and where their data starts, reading the archive only once per version.
+
+    Parameters:
+    archive (str): The path to the archive.
+
+    Returns:
+    dict: Member names mapped to (offset, size, compression, prefix).
+    """
+    stat = os.stat(archive)
+    return _member_index(archive, (stat.st_mtime_ns, stat.st_size))
+
+# ----- member_exists -----
+def member_exists(path):
+    """
+    Checks whether an archive-member path points at an existing member.
+
+    Parameters:
+    path (str): An archive-member path.
+
+    Returns:
+    bool: Whether the archive exists and holds the member.
+    """
+    parts = split_archive_path(path)
+    if parts is None or not os.path.isfile(parts[0]):
+        return False
+    try:
+        return parts[1] in member_index(parts[0])
+    except (OSError, tarfile.TarError, zipfile.BadZipFile):
+        return False
+
+# ----- _member_chunks -----
+def _member_chunks(archive, member, chunk_size=65536):
+    """
+    Yields the data of one archive member in chunks, starting at its cached offset.
+
+    Parameters:
+    archive (str): The path to the archive.
+    member (str): The member name.
+    chunk_size (int): The number of bytes to read at a time. Default is 65536.
+
+    Returns:
+    generator: Chunks of the member's (archive-level decompressed) bytes.
+    """
+    index = member_index(archive)
+    if member not in index:
+        raise FileNotFoundError(f"The directory or file {archive}{ARCHIVE_SEPARATOR}{member} does not exist.")
+    offset, size, compression, _ = index[member]
+
+    if zipfile.is_zipfile(archive):
+        opener = open
+    else:
+        opener = _stream_opener(archive)
+    if compression not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        raise ValueError(f"{archive}{ARCHIVE_SEPARATOR}{member} uses an unsupported zip compression.")
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS) if compression == zipfile.ZIP_DEFLATED else None
+
+    # Seeking a compressed tar stream decompresses up to the offset, but never past the member
+    with opener(archive, "rb") as file:
+        file.seek(offset)
+        remaining = size
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield inflater.decompress(chunk) if inflater is not None else chunk
+
+# ----- read_member_prefix -----
+def read_member_prefix(path, n_bytes=HEADER_BYTES):
+    """
+    Reads the first bytes of an archive member, decompressing a .gz member only as far as needed.
+
+    Bytes captured while the archive was indexed are returned without reading the archive again.
+
+    Parameters:
+    path (str): An archive-member path.
+    n_bytes (int): The number of bytes to read. Default is HEADER_BYTES.
+
+    Returns:
+    bytes: Up to n_bytes of the member's uncompressed content.
+    """
+    archive, member = split_archive_path(path)
+    entry = member_index(archive).get(member)
+    if entry is not None and entry[3] is not None:
+        prefix = entry[3]
+        whole = not member.endswith(".gz") and len(prefix) == entry[1]
+        if len(prefix) >= n_bytes or whole:
+            return prefix[:n_bytes]
+
+    # wbits of 16 + MAX_WBITS expects a gzip wrapper, as in .nii.gz
+    gunzip = zlib.decompressobj(16 + zlib.MAX_WBITS) if member.endswith(".gz") else None
+
+    data = b""
+    chunks = _member_chunks(archive, member, chunk_size=4096 if gunzip is None else 16384)
+    try:
+        for chunk in chunks:
+            data += gunzip.decompress(chunk, n_bytes - len(data)) if gunzip is not None else chunk
+            if len(data) >= n_bytes:
+                break
+    finally:
+        chunks.close()
+    return data[:n_bytes]
+
+# ----- list_members -----
+def list_members(path):
+    """
+    Lists the files directly inside a directory of an archive.
+
+    Parameters:
+    path (str): An archive-member path to a directory ("archive.tar::sub-01/func", or "archive.tar::" for the top level).
+
+    Returns:
+    list: The archive-member paths of the files in that directory.
+    """
+    archive, directory = split_archive_path(path)
+    directory = directory.rstrip("/")
+    return [f"{archive}{ARCHIVE_SEPARATOR}{member}" for member in member_index(archive)
+            if posixpath.dirname(member) == directory]
+
+# ----- nifti_header -----
+def nifti_header(path):
+    """
+    Reads the NIfTI header of an archive member without extracting it.
+
+    Parameters:
+    path (str): An archive-member path.
+
+    Returns:
+    nibabel.Nifti1Header or nibabel.Nifti2Header: The header.
+    """
+    data = read_member_prefix(path)
+    sizeof_hdr = struct.unpack("<i", data[:4])[0]
+    if sizeof_hdr in (348, 0x5c010000):
+        return nib.Nifti1Header.from_fileobj(io.BytesIO(data[:348]))
+    return nib.Nifti2Header.from_fileobj(io.BytesIO(data))
@@ -0,0 +1,191 @@
+import inspect
+import os
+import numpy as np
+from . import feat_functions
+from . import utilities
+
+# lowlvl_fsf options that beta-series designs set themselves, since their EVs differ per design
+UNSUPPORTED_OPTIONS = ("contrasts", "orthogonalise")
+
+# ----- split_trials -----
+def split_trials(ev_file, ev_dir, prefix):
+    """
+    Splits a 3-column EV file into one single-trial EV file and one "rest of trials" EV file per trial.
+
+    Every row is formatted once; each "rest" file is then selected from the formatted rows with a
+    row of a boolean (not-identity) mask rather than by re-reading or re-formatting the EV file.
+
+    Parameters:
+    ev_file (str): The path to the 3-column EV file.
+    ev_dir (str): The directory where the split EV files should be saved.
+    prefix (str): A prefix for the split EV file names (e.g., the EV name).
+
+    Returns:
+    list: One (trial EV path, rest EV path or None, onset) tuple per trial, in onset order.
+          The rest path is None when the EV holds a single trial.
+    """
+    utilities.check_directory_exists(ev_file)
+
+    block = np.loadtxt(ev_file, ndmin=2)
+    if block.size == 0:
+        return []
+    block = block[np.argsort(block[:, 0], kind="stable")]
+    n_trials = len(block)
+
+    lines = np.array([f"{onset:.6g}\t{duration:.6g}\t{weight:.6g}\n" for onset, duration, weight in block[:, :3]],
+                     dtype=object)
+    others = ~np.eye(n_trials, dtype=bool)
+
+    os.makedirs(ev_dir, exist_ok=True)
+    trials = []
+    for i in range(n_trials):
+        trial_file = os.path.join(ev_dir, f"{prefix}_trial-{i + 1:03d}.txt")
+        with open(trial_file, "w") as file:
+            file.write(lines[i])
+
+        rest_file = None
+        if n_trials > 1:
+            rest_file = os.path.join(ev_dir, f"{prefix}_trial-{i + 1:03d}_rest.txt")
+            with open(rest_file, "w") as file:
+                file.write("".join(lines[others[i]]))
+        trials.append((trial_file, rest_file, float(block[i, 0])))
+    return trials
+
+# ----- beta_series_fsf -----
+def beta_series_fsf(fsf_root,
+                    input_file,
+                    output_root,
+                    confound_file,
+                    tr,
+                    total_volumes,
+                    ev_files,
+                    ev_names,
+                    ev_dir,
+                    split_evs=None,
+                    method="LSS",
+                    prethresh_masking=None,
+                    **fsf_kwargs):
+    """
+    Generates single-trial (beta-series) first level .fsf files for one run.
+
+    The run is validated and probed once and every design reuses the result.
+    With method "LSS" (least-squares-separate), each trial of each split EV gets its own design
+    with three kinds of EVs: the trial, the rest of that EV's trials, and every other EV unchanged;
+    designs go to <fsf_root>/<EV name>_trial-<n>/design.fsf and FEAT output to
+    <output_root>/<EV name>_trial-<n>.
+    With method "LSA" (least-squares-all), a single design at <fsf_root>/design.fsf (output to
+    <output_root>/lsa) models every trial of the split EVs as its own EV, with one contrast per trial.
+
+    Parameters:
+    fsf_root (str): The directory under which the designs are created.
+    input_file (str or list): The path to the .nii.gz file (or a list, as in lowlvl_fsf).
+    output_root (str): The directory under which FEAT output directories are placed.
+    confound_file (str or list): The path to the confound file.
+    tr (float): Repetition time.
+    total_volumes (int): Total number of volumes.
+    ev_files (list): List of paths to 3-column EV files.
+    ev_names (list): List of names for EVs.
+    ev_dir (str): The directory where the split EV files should be saved.
+    split_evs (list): The names of the EVs to model trial by trial. Default is None, which splits all of them.
+    method (str): "LSS" or "LSA". Default is "LSS".
+    prethresh_masking (str): The pre-threshold mask. Default is None.
+    **fsf_kwargs: Any further lowlvl_fsf options (e.g., high_pass_filter), except contrasts and orthogonalise.
+
+    Returns:
+    list: A dictionary ("design_file", "output_dir", "ev_name", "trial", "onset") per trial.
+
+    Example:
+    beta_series_fsf(fsf_root="path/to/fsfs",
+                    input_file="path/to/your/input_file.nii.gz",
+                    output_root="path/to/feats",
+                    confound_file=None,
+                    tr=None,
+                    total_volumes=None,
+                    ev_files=["path/to/your/faces.txt", "path/to/your/houses.txt"],
+                    ev_names=["faces", "houses"],
+                    ev_dir="path/to/split_evs")
+    """
+    if method not in ("LSS", "LSA"):
+        raise ValueError(f"Method must be LSS or LSA, not {method}.")
+    if split_evs is None:
+        split_evs = list(ev_names)
+    unknown = [name for name in split_evs if name not in ev_names]
+    if unknown:
+        raise ValueError(f"{', '.join(unknown)} are not among the EV names.")
+
+    # Design options not given here take lowlvl_fsf's defaults
+    params = {name: parameter.default
+              for name, parameter in inspect.signature(feat_functions.lowlvl_fsf).parameters.items()
+              if parameter.default is not inspect.Parameter.empty}
+    unsupported = [name for name in fsf_kwargs if name in UNSUPPORTED_OPTIONS]
+    if unsupported:
+        raise ValueError(f"{', '.join(unsupported)} cannot be set for beta-series designs, "
+                         f"whose EVs and contrasts are generated per design.")
+    unknown = [name for name in fsf_kwargs if name not in params]
+    if unknown:
+        raise ValueError(f"{', '.join(unknown)} are not lowlvl_fsf options.")
+    params.update(fsf_kwargs)
+
+    # Validating and probing the run once for every design
+    utilities.check_directory_exists(fsf_root)
+    design = feat_functions._prepare_lowlvl(input_file, output_root, confound_file, tr, total_volumes,
+                                            ev_files, ev_names, params["delete_volumes"])
+    swept = feat_functions._swept_fields(params["high_pass_filter"], params["cluster_z"], params["cluster_p"],
+                                         params["thresholding"], params["film_prewhitening"])
+
+    # ----- render -----
+    def render(design_dir, output_dir, design_evs, contrasts):
+        os.makedirs(design_dir, exist_ok=True)
+        fsf_content = feat_functions._render_lowlvl(design, output_dir,
+                                                    [ev_file for _, ev_file in design_evs],
+                                                    [ev_name for ev_name, _ in design_evs],
+                                                    contrasts, prethresh_masking, params["add_motion_parameters"],
+                                                    params["timeseries_plot"], swept)
+        design_file = os.path.join(design_dir, "design.fsf")
+        with open(design_file, "w") as file:
+            file.write(fsf_content)
+        return design_file
+
+    all_evs = list(zip(ev_names, ev_files))
+    trials = {name: split_trials(ev_file, ev_dir, name) for name, ev_file in all_evs if name in split_evs}
+
+    rows = []
+    if method == "LSA":
+        design_evs = []
+        for name, ev_file in all_evs:
+            if name in trials:
+                design_evs.extend((f"{name}_trial-{i:03d}", trial_file)
+                                  for i, (trial_file, _, _) in enumerate(trials[name], start=1))
+            else:
+                design_evs.append((name, ev_file))
+        contrasts = {ev_name: [1 if other == ev_name else 0 for other, _ in design_evs]
+                     for ev_name, _ in design_evs if ev_name not in ev_names}
+        design_file = render(fsf_root, os.path.join(output_root, "lsa"), design_evs, contrasts)
+        for name in trials:
+            for i, (_, _, onset) in enumerate(trials[name], start=1):
+                rows.append({"design_file": design_file,
+                             "output_dir": os.path.join(output_root, "lsa"),
+                             "ev_name": name,
+                             "trial": i,
+                             "onset": onset})
+    else:
+        for name in trials:
+            others = [(other, ev_file) for other, ev_file in all_evs if other != name]
+            for i, (trial_file, rest_file, onset) in enumerate(trials[name], start=1):
+                label = f"{name}_trial-{i:03d}"
+                design_evs = [("trial", trial_file)]
+                if rest_file is not None:
+                    design_evs.append((f"{name}_rest", rest_file))
+                design_evs.extend(others)
+                contrasts = {"trial": [1] + [0] * (len(design_evs) - 1)}
+                design_file = render(os.path.join(fsf_root, label), os.path.join(output_root, label),
+                                     design_evs, contrasts)
+                rows.append({"design_file": design_file,
+                             "output_dir": os.path.join(output_root, label),
+                             "ev_name": name,
+                             "trial": i,
+                             "onset": onset})
+
+    # Print if successfully completed
+    print(f"{len(set(row['design_file'] for row in rows))} FSF files generated successfully.")
+    return rows
@@ -0,0 +1,363 @@
+import csv
+import os
+import re
+import numpy as np
+
+# BIDS suffixes that the discovery layer pairs together
+BOLD_SUFFIX = "_bold.nii.gz"
+EVENTS_SUFFIX = "_events.tsv"
+CONFOUNDS_SUFFIXES = ("_desc-confounds_timeseries.tsv", "_desc-confounds_regressors.tsv")
+
+# Directories at the top of a BIDS dataset that never hold raw runs
+SKIP_DIRS = {"derivatives", "sourcedata", "code", "stimuli"}
+
+# Default fMRIPrep confound columns (the six rigid-body motion parameters)
+MOTION_COLUMNS = ["trans_x", "trans_y", "trans_z", "rot_x", "rot_y", "rot_z"]
+
+# trial_type is optional in BIDS; events files without it describe a single condition of this name
+DEFAULT_TRIAL_TYPE = "events"
+
+# ----- _run_key -----
+def _run_key(file_name, suffix):
+    """
+    Strips a BIDS suffix from a file name, leaving the entities that identify a run.
+
+    Parameters:
+    file_name (str): The file name, without its directory.
+    suffix (str): The suffix to strip (e.g., "_bold.nii.gz").
+
+    Returns:
+    str: The run key (e.g., "sub-01_task-rest_run-1").
+    """
+    key = file_name[:-len(suffix)]
+
+    # fMRIPrep confounds never carry a space- entity, but preprocessed bolds do
+    return re.sub(r"_(space|res|desc)-[^_]+", "", key)
+
+# ----- _walk_files -----
+def _walk_files(root_dir, skip_dirs=()):
+    """
+    Yields every file beneath a directory, calling os.scandir once per directory.
+
+    Parameters:
+    root_dir (str): The directory to walk.
+    skip_dirs (iterable): Directory names to leave unvisited.
+
+    Returns:
+    generator: (directory, file name) tuples.
+    """
+    stack = [root_dir]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in skip_dirs:
+                            stack.append(entry.path)
+                    else:
+                        yield directory, entry.name
+        except OSError as e:
+            print(f"Error scanning {directory}: {e}")
+
+# ----- discover_bids -----
+def discover_bids(bids_dir, fmriprep_dir=None):
+    """
+    Walks a BIDS dataset once and pairs each BOLD run with its events and confounds.
+
+    Parameters:
+    bids_dir (str): The root of the BIDS dataset.
+    fmriprep_dir (str): The root of an fMRIPrep derivatives tree. Default is None.
+
+    Returns:
+    dict: Run keys mapped to dictionaries with "bold", "events" and "confounds" paths.
+          Runs without an events file are left out.
+    """
+    if not os.path.isdir(bids_dir):
+        raise FileNotFoundError(f"The directory or file {bids_dir} does not exist.")
+
+    bolds = {}
+    events = {}
+    for directory, name in _walk_files(bids_dir, SKIP_DIRS):
+        if name.endswith(BOLD_SUFFIX):
+            bolds[_run_key(name, BOLD_SUFFIX)] = os.path.join(directory, name)
+        elif name.endswith(EVENTS_SUFFIX):
+            events[_run_key(name, EVENTS_SUFFIX)] = os.path.join(directory, name)
+
+    confounds = {}
+    if fmriprep_dir is not None:
+        for directory, name in _walk_files(fmriprep_dir):
+            suffix = _confounds_suffix(name)
+            if suffix is not None:
+                confounds[_run_key(name, suffix)] = os.path.join(directory, name)
+
+    return _pair_runs(bolds, events, confounds)
+
+# ----- _confounds_suffix -----
+def _confounds_suffix(file_name):
+    """
+    Returns the fMRIPrep confounds suffix a file name ends with.
+
+    Parameters:
+    file_name (str): The file name, without its directory.
+
+    Returns:
+    str: The matching suffix, or None if the file is not a confounds file.
+    """
+    for suffix in CONFOUNDS_SUFFIXES:
+        if file_name.endswith(suffix):
+            return suffix
+    return None
+
+# ----- _pair_runs -----
+def _pair_runs(bolds, events, confounds):
+    """
+    Pairs BOLD runs with their events and confounds files by run key.
+
+    Parameters:
+    bolds (dict): Run keys mapped to _bold.nii.gz paths.
+    events (dict): Run keys (or task-level keys such as "task-rest") mapped to _events.tsv paths.
+    confounds (dict): Run keys mapped to fMRIPrep confounds paths.
+
+    Returns:
+    dict: Run keys mapped to dictionaries with "bold", "events" and "confounds" paths.
+          Runs without an events file are left out.
+    """
+    runs = {}
+    for key in sorted(bolds):
+        # Task-level events (e.g., task-x_events.tsv at the root) are inherited by every run
+        events_file = events.get(key)
+        if events_file is None:
+            task = re.search(r"task-[^_]+", key)
+            events_file = events.get(task.group(0)) if task else None
+        if events_file is None:
+            continue
+        runs[key] = {"bold": bolds[key],
+                     "events": events_file,
+                     "confounds": confounds.get(key)}
+    return runs
+
+# ----- _read_tsv -----
+def _read_tsv(tsv_file):
+    """
+    Reads a BIDS .tsv file into a dictionary of string columns.
+
+    Parameters:
+    tsv_file (str): The path to the .tsv file.
+
+    Returns:
+    dict: Column names mapped to NumPy string arrays.
+    """
+    with open(tsv_file, newline="") as file:
+        rows = list(csv.reader(file, delimiter="\t"))
+    if not rows:
+        raise ValueError(f"{tsv_file} is empty; a .tsv file needs at least a header row.")
+    header, body = rows[0], [row for row in rows[1:] if row]
+    if not body:
+        return {name: np.array([], dtype=str) for name in header}
+    columns = np.array(body, dtype=str).T
+    return dict(zip(header, columns))
+
+# ----- _to_float -----
+def _to_float(column, fill=np.nan):
+    """
+    Converts a string column to floats, treating BIDS "n/a" as a fill value.
+
+    Parameters:
+    column (numpy.ndarray): The string column.
+    fill (float): The value to use for "n/a". Default is NaN.
+
+    Returns:
+    numpy.ndarray: The float column.
+    """
+    values = np.full(column.shape, fill, dtype=float)
+    present = column != "n/a"
+    values[present] = column[present].astype(float)
+    return values
+
+# ----- events_to_evs -----
+def events_to_evs(events_file, output_dir, prefix=None, weight_column=None):
+    """
+    Converts a BIDS events.tsv file to one FSL 3-column EV file per trial_type.
+
+    Parameters:
+    events_file (str): The path to the _events.tsv file.
+    output_dir (str): The directory where the EV files should be saved.
+    prefix (str): A prefix for the EV file names. Default is the events file name.
+    weight_column (str): A column to use as the EV weight (e.g., "response_time"). Default is None, which uses 1.
+
+    Returns:
+    dict: trial_type names mapped to the paths of their EV files, in sorted order.
+          trial_types whose file names would clash (e.g., "go left" and "goleft") get numbered names,
+          and a file without a trial_type column gives a single DEFAULT_TRIAL_TYPE EV.
+    """
+    if not os.path.exists(events_file):
+        raise FileNotFoundError(f"The directory or file {events_file} does not exist.")
+    if prefix is None:
+        prefix = os.path.basename(events_file)[:-len(EVENTS_SUFFIX)]
+
+    columns = _read_tsv(events_file)
+    for required in ("onset", "duration"):
+        if required not in columns:
+            raise ValueError(f"{events_file} has no '{required}' column.")
+    if "trial_type" not in columns:
+        columns["trial_type"] = np.full(columns["onset"].shape, DEFAULT_TRIAL_TYPE)
+
+    onsets = _to_float(columns["onset"])
+    durations = _to_float(columns["duration"], fill=0.0)
+    weights = (_to_float(columns[weight_column], fill=0.0)
+               if weight_column is not None else np.ones_like(onsets))
+    trial_types = columns["trial_type"]
+
+    # Dropping events without an onset or a trial_type
+    keep = ~np.isnan(onsets) & (trial_types != "n/a")
+    block = np.column_stack((onsets, durations, weights))[keep]
+    trial_types = trial_types[keep]
+
+    # Grouping every row by trial_type in a single sort
+    names, inverse, counts = np.unique(trial_types, return_inverse=True, return_counts=True)
+    order = np.lexsort((block[:, 0], inverse))
+    groups = np.split(block[order], np.cumsum(counts)[:-1])
+
+    os.makedirs(output_dir, exist_ok=True)
+    ev_files = {}
+    used = set()
+    for name, rows in zip(names, groups):
+        # Distinct trial_types can clean to the same file name, so later ones are numbered
+        # (compared ignoring case, for case-insensitive filesystems)
+        safe_name = base_name = re.sub(r"[^A-Za-z0-9.-]+", "", str(name))
+        n = 1
+        while safe_name.lower() in used:
+            n += 1
+            safe_name = f"{base_name}-{n}"
+        used.add(safe_name.lower())
+        ev_file = os.path.join(output_dir, f"{prefix}_{safe_name}.txt")
+        np.savetxt(ev_file, rows, fmt="%.6g", delimiter="\t")
+        ev_files[str(name)] = ev_file
+    return ev_files
+
+# ----- confounds_to_txt -----
+def confounds_to_txt(confounds_file, output_file, columns=None):
+    """
+    Converts an fMRIPrep confounds .tsv file to the headerless text file FEAT expects.
+
+    Parameters:
+    confounds_file (str): The path to the fMRIPrep confounds .tsv file.
+    output_file (str): The path of the text file to write.
+    columns (list): The confound columns to keep. Default is the six motion parameters.
+
+    Returns:
+    str: The path of the written text file.
+    """
+    if columns is None:
+        columns = MOTION_COLUMNS
+
+    table = _read_tsv(confounds_file)
+    missing = [column for column in columns if column not in table]
+    if missing:
+        raise ValueError(f"{confounds_file} has no column(s) {', '.join(missing)}.")
+
+    # Derivative columns begin with "n/a", which FEAT cannot read
+    matrix = np.column_stack([_to_float(table[column], fill=0.0) for column in columns])
+    np.savetxt(output_file, matrix, fmt="%.6g", delimiter="\t")
+    return output_file
+
+# ----- bids_jobs -----
+def bids_jobs(bids_dir,
+              fsf_root,
+              output_root,
+              ev_root,
+              fmriprep_dir=None,
+              contrasts=None,
+              confound_columns=None,
+              prethresh_masking=None,
+              create_fsf_dirs=True,
+              **fsf_kwargs):
+    """
+    Discovers a BIDS dataset and yields ready-to-run keyword arguments for lowlvl_fsf.
+
+    Parameters:
+    bids_dir (str): The root of the BIDS dataset.
+    fsf_root (str): The directory under which one design directory per run is created.
+    output_root (str): The directory under which FEAT output directories are placed.
+    ev_root (str): The directory under which the converted EV files are written.
+    fmriprep_dir (str): The root of an fMRIPrep derivatives tree. Default is None.
+    contrasts (dict): Dictionary of contrasts. Default is None, which gives one contrast per EV.
+    confound_columns (list): The fMRIPrep confound columns to keep. Default is the six motion parameters.
+    prethresh_masking (str): The pre-threshold mask. Default is None.
+    create_fsf_dirs (bool): Whether to create each run's design and output directories (neither is needed when designs go to a bundle, as FEAT creates its output directory itself). Default is True.
+    **fsf_kwargs: Any further lowlvl_fsf arguments (e.g., high_pass_filter), passed through unchanged.
+
+    Returns:
+    generator: Dictionaries of lowlvl_fsf keyword arguments, one per run.
+
+    Example:
+    for job in bids_jobs("path/to/bids", "path/to/fsfs", "path/to/feats", "path/to/evs"):
+        lowlvl_fsf(**job)
+    """
+    runs = discover_bids(bids_dir, fmriprep_dir)
+
+    for key, run in runs.items():
+        ev_dir = os.path.join(ev_root, key)
+
+        # One malformed run is skipped rather than ending discovery for the whole dataset
+        try:
+            ev_files = events_to_evs(run["events"], ev_dir, prefix=key)
+            if not ev_files:
+                print(f"No events found in {run['events']}; skipping {key}.")
+                continue
+
+            confound_file = None
+            if run["confounds"] is not None:
+                confound_file = confounds_to_txt(run["confounds"],
+                                                 os.path.join(ev_dir, f"{key}_confounds.txt"),
+                                                 confound_columns)
+        except (OSError, ValueError) as e:
+            print(f"Error converting the events or confounds of {key}: {e}; skipping {key}.")
+            continue
+
+        yield _run_job(key, run["bold"], ev_files, confound_file, fsf_root, output_root,
+                       contrasts, prethresh_masking, fsf_kwargs, create_fsf_dirs)
+
+# ----- _run_job -----
+def _run_job(key, bold_file, ev_files, confound_file, fsf_root, output_root,
+             contrasts, prethresh_masking, fsf_kwargs, create_fsf_dirs=True):
+    """
+    Assembles the lowlvl_fsf keyword arguments of one run, optionally creating its design and output directories.
+
+    Parameters:
+    key (str): The run key.
+    bold_file (str): The path to the run's _bold.nii.gz file.
+    ev_files (dict): trial_type names mapped to EV file paths, as returned by events_to_evs.
+    confound_file (str): The path to the FEAT confounds text file, or None.
+    fsf_kwargs (dict): Any further lowlvl_fsf arguments.
+    See bids_jobs for the others.
+
+    Returns:
+    dict: The lowlvl_fsf keyword arguments.
+    """
+    ev_names = list(ev_files)
+    if contrasts is None:
+        contrasts = {name: [1 if other == name else 0 for other in ev_names]
+                     for name in ev_names}
+
+    fsf_dir = os.path.join(fsf_root, key)
+    output_dir = os.path.join(output_root, key)
+    if create_fsf_dirs:
+        os.makedirs(fsf_dir, exist_ok=True)
+        os.makedirs(output_dir, exist_ok=True)
+
+    job = {"fsf_dir": fsf_dir,
+           "input_file": bold_file,
+           "output_dir": output_dir,
+           "confound_file": confound_file,
+           "tr": None,
+           "total_volumes": None,
+           "ev_files": list(ev_files.values()),
+           "ev_names": ev_names,
+           "contrasts": contrasts,
+           "prethresh_masking": prethresh_masking}
+    job.update(fsf_kwargs)
+    return job
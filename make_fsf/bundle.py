@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import time
+import zlib
+from . import feat_functions
+
+# Rows are only ever appended; a design written twice is read back from its latest row
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS designs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    created REAL NOT NULL,
+    content BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS designs_name ON designs (name, id);
+"""
+
+# ----- open_bundle -----
+def open_bundle(bundle_file, readonly=False):
+    """
+    Opens (or creates) a design bundle: a single SQLite file holding many rendered .fsf files.
+
+    Parameters:
+    bundle_file (str): The path to the bundle.
+    readonly (bool): Whether to open it for reading only. Default is False.
+
+    Returns:
+    sqlite3.Connection: The open bundle.
+    """
+    if readonly:
+        if not os.path.exists(bundle_file):
+            raise FileNotFoundError(f"The directory or file {bundle_file} does not exist.")
+        return sqlite3.connect(f"file:{bundle_file}?mode=ro", uri=True)
+
+    connection = sqlite3.connect(bundle_file)
+
+    # The rollback journal, unlike write-ahead logging, needs no shared memory and so works on
+    # network and parallel filesystems; it still keeps committed designs intact if a batch is interrupted.
+    # PERSIST reuses one journal file rather than creating and deleting it on every commit
+    connection.execute("PRAGMA journal_mode=PERSIST")
+    connection.executescript(SCHEMA)
+    return connection
+
+# ----- add_designs -----
+def add_designs(connection, designs):
+    """
+    Appends rendered designs to a bundle in a single transaction.
+
+    Parameters:
+    connection (sqlite3.Connection): A bundle returned by open_bundle.
+    designs (iterable): (name, fsf_content) tuples; the name is the path the design would be extracted to.
+
+    Returns:
+    int: The number of designs added.
+    """
+    now = time.time()
+    rows = [(name, now, zlib.compress(fsf_content.encode())) for name, fsf_content in designs]
+    with connection:
+        connection.executemany("INSERT INTO designs (name, created, content) VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+# ----- bundle_fsf -----
+def bundle_fsf(jobs, bundle_file, batch_size=256):
+    """
+    Renders first level designs into a bundle instead of one directory and file per job.
+
+    Each design is stored under <fsf_dir>/design.fsf, the path lowlvl_fsf would have written;
+    neither fsf_dir nor output_dir needs to exist, since FEAT creates its output directory
+    itself. Designs are committed batch_size at a time, and whatever was rendered is still
+    committed if a job fails.
+
+    Parameters:
+    jobs (iterable): Dictionaries of lowlvl_fsf keyword arguments (e.g., from bids.bids_jobs).
+    bundle_file (str): The path to the bundle.
+    batch_size (int): The number of designs committed together. Default is 256.
+
+    Returns:
+    list: The names of the stored designs.
+
+    Example:
+    bundle_fsf(bids_jobs("path/to/bids", "path/to/fsfs", "path/to/feats", "path/to/evs", create_fsf_dirs=False),
+               "path/to/designs.sqlite")
+    """
+    names = []
+    batch = []
+    connection = open_bundle(bundle_file)
+    try:
+        for job in jobs:
+            name = os.path.join(job["fsf_dir"], "design.fsf")
+            batch.append((name, feat_functions.render_lowlvl_fsf(**job, check_output_dir=False)))
+            names.append(name)
+            if len(batch) >= batch_size:
+                pending, batch = batch, []
+                add_designs(connection, pending)
+    finally:
+        try:
+            if batch:
+                add_designs(connection, batch)
+        finally:
+            connection.close()
+
+    # Print if successfully completed
+    print(f"{len(names)} FSF files bundled successfully.")
+    return names
+
+# ----- list_designs -----
+def list_designs(bundle_file):
+    """
+    Lists the designs held in a bundle.
+
+    Parameters:
+    bundle_file (str): The path to the bundle.
+
+    Returns:
+    list: The distinct design names, sorted.
+    """
+    connection = open_bundle(bundle_file, readonly=True)
+    try:
+        return [name for (name,) in connection.execute("SELECT DISTINCT name FROM designs ORDER BY name")]
+    finally:
+        connection.close()
+
+# ----- extract_design -----
+def extract_design(bundle_file, name, design_file=None):
+    """
+    Writes one design from a bundle to disk, e.g. right before its FEAT job runs.
+
+    Parameters:
+    bundle_file (str): The path to the bundle.
+    name (str): The name the design was stored under.
+    design_file (str): Where to write it. Default is None, which uses the name itself.
+
+    Returns:
+    str: The path of the written .fsf file.
+
+    Example:
+    feat $(python -c "from make_fsf.bundle import extract_design; print(extract_design('designs.sqlite', 'path/to/design.fsf'))")
+    """
+    connection = open_bundle(bundle_file, readonly=True)
+    try:
+        row = connection.execute("SELECT content FROM designs WHERE name = ? ORDER BY id DESC LIMIT 1",
+                                 (name,)).fetchone()
+    finally:
+        connection.close()
+    if row is None:
+        raise KeyError(f"{bundle_file} holds no design named {name}.")
+
+    if design_file is None:
+        design_file = name
+    directory = os.path.dirname(design_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(design_file, "w") as file:
+        file.write(zlib.decompress(row[0]).decode())
+    return design_file
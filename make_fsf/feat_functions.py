@@ -1,72 +1,158 @@
-import utilities
+import numbers
+import numpy as np
+from . import archives
+from . import utilities
 
-# ----- lowlvl_fsf -----
-def lowlvl_fsf(fsf_dir,
-               input_file, 
-               output_dir,
-               confound_file,
-               tr, 
-               total_volumes,
-               ev_files, 
-               ev_names, 
-               contrasts,
-               prethresh_masking,
-               delete_volumes = 0,
-               high_pass_filter = 100,
-               film_prewhitening = True,
-               add_motion_parameters = True,
-               thresholding = "Cluster",
-               cluster_z = 3.1,
-               cluster_p = 0.05,
-               timeseries_plot = True):
+# Thresholding methods as FEAT numbers them
+THRESHOLDING = {"None": 0, "Uncorrected": 1, "Voxel": 2, "Cluster": 3}
 
+# ----- _swept_fields -----
+def _swept_fields(high_pass_filter, cluster_z, cluster_p, thresholding, film_prewhitening):
     """
-    Generates a first level .fsf file with specified parameters.
+    Formats the design values that parameter sweeps vary.
 
     Parameters:
-    input_file (str): The path to the .nii.gz file.
-    output_dir (str): The directory where the output should be saved.
-    confound_file (str): The path to the confound file.
-    tr (float): Repetition time.
-    total_volumes (int): Total number of volumes.
-    ev_files (list): List of paths to EV files.
+    See lowlvl_fsf.
+
+    Returns:
+    dict: "paradigm_hp", "z_thresh", "prob_thresh", "thresh" and "prewhiten_yn" as .fsf strings.
+    """
+    if thresholding in THRESHOLDING:
+        thresholding = THRESHOLDING[thresholding]
+    elif thresholding not in THRESHOLDING.values():
+        raise ValueError(f"Thresholding must be one of {', '.join(THRESHOLDING)} (or 0-3), not {thresholding}.")
+
+    return {"paradigm_hp": str(high_pass_filter),
+            "z_thresh": str(cluster_z),
+            "prob_thresh": str(cluster_p),
+            "thresh": str(thresholding),
+            "prewhiten_yn": "1" if film_prewhitening else "0"}
+
+# ----- _ortho_matrix -----
+def _ortho_matrix(orthogonalise, ev_names):
+    """
+    Converts an orthogonalisation specification into a boolean matrix and checks it for cycles.
+
+    Parameters:
+    orthogonalise (numpy.ndarray or list): An n x n boolean matrix whose [i, x] entry orthogonalises
+        EV i+1 with respect to EV x+1, or a list of (EV, EV) pairs given as 1-based numbers or EV names.
+        None means no orthogonalisation.
     ev_names (list): List of names for EVs.
-    contrasts (dict): Dictionary of contrasts.
-    delete_volumes (int): Number of volumes to delete. Default is 0.
-    high_pass_filter (float): High-pass filter value. Default is 100.
-    film_prewhitening (bool): Whether to perform FILM prewhitening. Default is True.
-    thresholding (str): Thresholding method. Default is "None".
-    cluster_z (float): Z-threshold for clusters. Default is 3.29.
-    cluster_p (float): P-threshold for clusters. Default is 0.001.
-    timeseries_plot (bool): Whether to generate timeseries plots. Default is False.
 
     Returns:
-    file: an .fsf file at the specified path
+    numpy.ndarray: The n x n boolean matrix.
+    """
+    n_evs = len(ev_names)
+    if orthogonalise is None:
+        return np.zeros((n_evs, n_evs), dtype=bool)
+
+    if isinstance(orthogonalise, np.ndarray):
+        if orthogonalise.shape != (n_evs, n_evs):
+            raise ValueError(f"The orthogonalisation matrix must be {n_evs} x {n_evs}, not {orthogonalise.shape}.")
+        matrix = orthogonalise.astype(bool)
+    else:
+        matrix = np.zeros((n_evs, n_evs), dtype=bool)
+        for pair in orthogonalise:
+            if len(pair) != 2:
+                raise ValueError(f"Each orthogonalisation pair must hold two EVs, not {len(pair)} ({pair}).")
+            indices = []
+            for ev in pair:
+                if isinstance(ev, str):
+                    index = ev_names.index(ev) if ev in ev_names else -1
+                elif isinstance(ev, numbers.Integral) and not isinstance(ev, bool):
+                    index = int(ev) - 1
+                else:
+                    raise ValueError(f"EV {ev!r} in the orthogonalisation pairs must be an EV number or name.")
+                if not 0 <= index < n_evs:
+                    raise ValueError(f"EV {ev} in the orthogonalisation pairs does not exist.")
+                indices.append(index)
+            matrix[indices[0], indices[1]] = True
+
+    if matrix.diagonal().any():
+        raise ValueError("An EV cannot be orthogonalised with respect to itself.")
+
+    # Peeling off EVs that depend on no remaining EV; whatever cannot be peeled lies on a cycle
+    remaining = np.ones(n_evs, dtype=bool)
+    while remaining.any():
+        free = remaining & ~matrix[:, remaining].any(axis=1)
+        if not free.any():
+            cycle = ", ".join(str(ev_names[i]) for i in np.flatnonzero(remaining))
+            raise ValueError(f"The orthogonalisation of these EVs is circular: {cycle}.")
+        remaining &= ~free
+    return matrix
+
+# ----- _ortho_blocks -----
+def _ortho_blocks(matrix):
+    """
+    Formats every fmri(ortho{i}.{x}) entry in one pass, including the x = 0 entries FEAT expects.
 
-    Example:
-    lowlvl_fsf(
-        input_file="path/to/your/input_file.nii.gz",
-        output_dir="path/to/your/output_directory",
-        confound_file="path/to/your/confound_file.txt",
-        tr=2.0,
-        total_volumes=240,
-        ev_files=["path/to/your/ev1.txt", "path/to/your/ev2.txt", "path/to/your/ev3.txt"],
-        ev_names=["EV1", "EV2", "EV3"],
-        contrasts={
-            "Contrast 1": [1, 0, 0],
-            "Contrast 2": [0, 1, 0],
-            "Contrast 3": [0, 0, 1]
-        }
-    )    
+    Parameters:
+    matrix (numpy.ndarray): The n x n boolean matrix returned by _ortho_matrix.
+
+    Returns:
+    list: One string per EV holding its orthogonalisation entries.
+    """
+    n_evs = len(matrix)
+    values = np.zeros((n_evs, n_evs + 1), dtype=int)
+    values[:, 1:] = matrix
+
+    # Laying out the arguments of every entry with NumPy, so each EV is a single % operation
+    i = np.repeat(np.arange(1, n_evs + 1), n_evs + 1)
+    x = np.tile(np.arange(n_evs + 1), n_evs)
+    arguments = np.column_stack((i, x, i, x, values.ravel())).reshape(n_evs, -1).tolist()
+    template = "\n# Orthogonalise EV %d wrt EV %d\nset fmri(ortho%d.%d) %d\n" * (n_evs + 1)
+    return [template % tuple(row) for row in arguments]
+
+# ----- _prepare_lowlvl -----
+def _prepare_lowlvl(input_file,
+                    output_dir,
+                    confound_file,
+                    tr,
+                    total_volumes,
+                    ev_files,
+                    ev_names,
+                    delete_volumes,
+                    check_output_dir=True):
+    """
+    Validates the inputs of a first level design and probes whatever was not manually defined.
+
+    Parameters:
+    check_output_dir (bool): Whether output_dir must already exist (FEAT creates it otherwise). Default is True.
+    See lowlvl_fsf for the others.
+
+    Returns:
+    dict: "input_files", "confound_files", "tr", "total_volumes", "delete_volumes" and "voxels".
     """
     # --- QA Checks ---
+    # Treating a single input (and its confound file) as a list of one
+    input_files = [input_file] if isinstance(input_file, str) else list(input_file)
+    if confound_file is None:
+        confound_files = [None] * len(input_files)
+    elif isinstance(confound_file, str):
+        # One run's motion regressors do not describe any other run
+        if len(input_files) > 1:
+            raise ValueError("A single confound file cannot be applied to several input files; give one per input.")
+        confound_files = [confound_file]
+    else:
+        confound_files = list(confound_file)
+
+    # Checking that there is one confound file per input
+    if len(confound_files) != len(input_files):
+        raise ValueError("The number of confound files must be equal to the number of input files.")
+
+    # FEAT turns confounds on for every input or none, so a gap would point it at an empty path
+    missing = sum(confound is None for confound in confound_files)
+    if 0 < missing < len(confound_files):
+        raise ValueError("Either every input file or none must have a confound file.")
+
     # Checking the file paths for inputs and outputs
-    for path in [fsf_dir, input_file, output_dir]:
+    for path in [output_dir, *input_files] if check_output_dir else input_files:
         utilities.check_directory_exists(path)
 
-    # If a confound file was submitted, checking that it exists
-    if confound_file is not None:
-        utilities.check_directory_exists(confound_file)
+    # If confound files were submitted, checking that they exist
+    for confound in confound_files:
+        if confound is not None:
+            utilities.check_directory_exists(confound)
     
     # Checking the file paths for ev files 
     for ev in ev_files:
@@ -78,18 +164,72 @@ def lowlvl_fsf(fsf_dir,
 
     # --- Defining variables
 
-    # Checking if TR has been manually defined
-    if tr is None:
-        tr = utilities.tr_from_nifti(input_file)
+    # Probing every input at once; FEAT applies one design to all of them, so they must agree
+    probes = utilities.probe_niftis(input_files, detect_dummies=delete_volumes == "auto")
+
+    # Values the caller supplied override the probes (e.g., a header whose pixdim[4] is 0), so only the
+    # rest are compared, and inputs whose value could not be read are treated as unknown
+    tolerances = {"tr": utilities.TR_TOLERANCE, "volumes": 0}
+    supplied = {"tr": tr, "volumes": total_volumes}
+    known = {}
+    for key, tolerance in tolerances.items():
+        known[key] = [probe[key] for probe in probes if probe[key] is not None]
+        if supplied[key] is None and known[key] and max(known[key]) - min(known[key]) > tolerance:
+            details = ", ".join(f"{probe['file']}: {probe[key]}" for probe in probes)
+            raise ValueError(f"The input files do not share the same {key} ({details}).")
+
+    # Checking if TR has been manually defined (the BIDS sidecar is trusted over the header)
+    if tr is None and known["tr"]:
+        tr = known["tr"][0]
 
     # Checking if volumes have been manually defined
-    if total_volumes is None:
-        total_volumes = utilities.vols_from_nifti(input_file)
+    if total_volumes is None and known["volumes"]:
+        total_volumes = known["volumes"][0]
+
+    # Deleting enough volumes to cover the dummies of every input (FEAT subtracts these from npts itself)
+    if delete_volumes == "auto":
+        dummies = [probe["dummies"] for probe in probes]
+        if None in dummies:
+            raise ValueError("Dummy volumes could not be detected for every input file.")
+        delete_volumes = max(dummies)
+
+    return {"input_files": input_files,
+            "confound_files": confound_files,
+            "tr": tr,
+            "total_volumes": total_volumes,
+            "delete_volumes": delete_volumes,
+            "voxels": probes[0]["voxels"]}
+
+# ----- _render_lowlvl -----
+def _render_lowlvl(design,
+                   output_dir,
+                   ev_files,
+                   ev_names,
+                   contrasts,
+                   prethresh_masking,
+                   add_motion_parameters,
+                   timeseries_plot,
+                   swept,
+                   orthogonalise=None):
+    """
+    Renders the text of a first level .fsf file.
+
+    Parameters:
+    design (dict): The validated inputs returned by _prepare_lowlvl.
+    swept (dict): The formatted values returned by _swept_fields.
+    orthogonalise (numpy.ndarray or list): See lowlvl_fsf. Default is None.
+    See lowlvl_fsf for the others.
 
-    # Defining number of EVs and contrasts
+    Returns:
+    str: The .fsf file contents.
+    """
+    # Defining number of inputs, EVs and contrasts
+    input_files = design["input_files"]
+    confound_files = design["confound_files"]
+    n_inputs = len(input_files)
     n_evs = len(ev_files)
     n_contrasts = len(contrasts)
-    
+
     # Creating an object to retain fsf text
     fsf_content = f"""
 # FEAT version number
@@ -117,19 +257,19 @@ set fmri(sscleanup_yn) 0
 set fmri(outputdir) "{output_dir}"
 
 # TR(s)
-set fmri(tr) {tr}
+set fmri(tr) {design["tr"]}
 
 # Total volumes
-set fmri(npts) {total_volumes}
+set fmri(npts) {design["total_volumes"]}
 
 # Delete volumes
-set fmri(ndelete) {delete_volumes}
+set fmri(ndelete) {design["delete_volumes"]}
 
 # Perfusion tag/control order
 set fmri(tagfirst) 1
 
 # Number of first-level analyses
-set fmri(multiple) 1
+set fmri(multiple) {n_inputs}
 
 # Carry out pre-stats processing?
 set fmri(filtering_yn) 1
@@ -168,7 +308,7 @@ set fmri(unwarp_dir) y-
 set fmri(stats_yn) 1
 
 # Carry out prewhitening?
-set fmri(prewhiten_yn) {1 if film_prewhitening else 0}
+set fmri(prewhiten_yn) {swept["prewhiten_yn"]}
 
 # Add motion parameters to model
 # 0 : No
@@ -202,13 +342,13 @@ set fmri(threshmask) "{prethresh_masking if prethresh_masking is not None else "
 # 1 : Uncorrected
 # 2 : Voxel
 # 3 : Cluster
-set fmri(thresh) {thresholding}
+set fmri(thresh) {swept["thresh"]}
 
 # P threshold
-set fmri(prob_thresh) {cluster_p}
+set fmri(prob_thresh) {swept["prob_thresh"]}
 
 # Z threshold
-set fmri(z_thresh) {cluster_z}
+set fmri(z_thresh) {swept["z_thresh"]}
 
 # Z min/max for colour rendering
 # 0 : Use actual Z min/max
@@ -238,28 +378,33 @@ set fmri(bgimage) 1
 set fmri(tsplot_yn) {1 if timeseries_plot else 0}
 
 # High pass filter cutoff
-set fmri(paradigm_hp) {high_pass_filter}
+set fmri(paradigm_hp) {swept["paradigm_hp"]}
 
 # Total voxels
-set fmri(totalVoxels) {utilities.voxels_from_nifti}
+set fmri(totalVoxels) {design["voxels"]}
 
 # Number of lower-level copes feeding into higher-level analysis
 set fmri(ncopeinputs) 0
 
-# 4D AVW data or FEAT directory (1)
-set feat_files(1) "{input_file}"
-
 # Add confound EVs text file
-set fmri(confoundevs) {1 if confound_file is not None else 0}
+set fmri(confoundevs) {1 if any(confound is not None for confound in confound_files) else 0}
+    """
 
-# Confound EVs text file for analysis 1
-set confoundev_files(1) "{confound_file}"
+    # Adding inputs
+    for n, (feat_file, confound) in enumerate(zip(input_files, confound_files), start=1):
+        fsf_content += f"""
+# 4D AVW data or FEAT directory ({n})
+set feat_files({n}) "{archives.extracted_path(feat_file)}"
 
-    """
+# Confound EVs text file for analysis {n}
+set confoundev_files({n}) "{confound if confound is not None else ""}"
+"""
 
-    # Adding EVs
+    # Adding EVs, each followed by its orthogonalisation entries
+    ortho_blocks = _ortho_blocks(_ortho_matrix(orthogonalise, list(ev_names)))
+    ev_blocks = []
     for i, (ev_file, ev_name) in enumerate(zip(ev_files, ev_names), start=1):
-        fsf_content += f"""
+        ev_blocks.append(f"""
 # EV {i} title
 set fmri(evtitle{i}) "{ev_name}"
 
@@ -294,14 +439,10 @@ set fmri(deriv_yn{i}) 1
 
 # Custom EV file (EV {i})
 set fmri(custom{i}) "{ev_file}"
-        """
+        """)
+        ev_blocks.append(ortho_blocks[i - 1])
+    fsf_content += "".join(ev_blocks)
 
-###################################################
-# NOTE: FIND A WAY TO ADD ORTHOGONALIZATION HERE
-# # Orthogonalise EV {i} wrt EV {x}
-# set fmri(ortho{i}.{x}) 0
-##################################################
-    
     # Adding contrasts
     fsf_content += f"""
 # Contrast & F-tests mode
@@ -312,17 +453,19 @@ set fmri(con_mode) orig
 
         """
     
+    contrast_blocks = []
     for j, (contrast_name, contrast_values) in enumerate(contrasts.items(), start=1):
-        fsf_content += f"""
+        contrast_blocks.append(f"""
 # Display images for contrast_real {j}
 set fmri(conpic_real.{j}) 1
 
 # Title for contrast_real {j}
 set fmri(conname_real.{j}) "{contrast_name}"
-        """
+        """)
 
         for k, value in enumerate(contrast_values, start=1):
-            fsf_content += f"set fmri(con_real{j}.{k}) {value}\n"
+            contrast_blocks.append(f"set fmri(con_real{j}.{k}) {value}\n")
+    fsf_content += "".join(contrast_blocks)
 
     fsf_content += f"""
 ##########################################################
@@ -344,8 +487,116 @@ set fmri(init_standard) ""
 set fmri(overwrite_yn) 0
         """
 
+    return fsf_content
+
+# ----- lowlvl_fsf -----
+def lowlvl_fsf(fsf_dir,
+               input_file, 
+               output_dir,
+               confound_file,
+               tr, 
+               total_volumes,
+               ev_files, 
+               ev_names, 
+               contrasts,
+               prethresh_masking,
+               delete_volumes = 0,
+               high_pass_filter = 100,
+               film_prewhitening = True,
+               add_motion_parameters = True,
+               thresholding = "Cluster",
+               cluster_z = 3.1,
+               cluster_p = 0.05,
+               timeseries_plot = True,
+               orthogonalise = None):
+
+    """
+    Generates a first level .fsf file with specified parameters.
+
+    Parameters:
+    input_file (str or list): The path to the .nii.gz file, or a list of paths to run the same design on several inputs. Archive-member paths ("archive.tar::member.nii.gz") are probed in place and written as the path the member will have once the archive is unpacked beside itself.
+    output_dir (str): The directory where the output should be saved.
+    confound_file (str or list): The path to the confound file, or a list with one path per input (all or none).
+    tr (float): Repetition time.
+    total_volumes (int): Total number of volumes.
+    ev_files (list): List of paths to EV files.
+    ev_names (list): List of names for EVs.
+    contrasts (dict): Dictionary of contrasts.
+    delete_volumes (int or str): Number of volumes to delete, or "auto" to detect dummy volumes from the data. Default is 0.
+    high_pass_filter (float): High-pass filter value. Default is 100.
+    film_prewhitening (bool): Whether to perform FILM prewhitening. Default is True.
+    thresholding (str or int): Thresholding method ("None", "Uncorrected", "Voxel" or "Cluster"). Default is "Cluster".
+    cluster_z (float): Z-threshold for clusters. Default is 3.29.
+    cluster_p (float): P-threshold for clusters. Default is 0.001.
+    timeseries_plot (bool): Whether to generate timeseries plots. Default is False.
+    orthogonalise (numpy.ndarray or list): EVs to orthogonalise, as an n x n boolean matrix ([i, x] orthogonalises EV i+1 wrt EV x+1) or a list of (EV, EV) pairs by 1-based number or name. Default is None.
+
+    Returns:
+    file: an .fsf file at the specified path
+
+    Example:
+    lowlvl_fsf(
+        input_file="path/to/your/input_file.nii.gz",
+        output_dir="path/to/your/output_directory",
+        confound_file="path/to/your/confound_file.txt",
+        tr=2.0,
+        total_volumes=240,
+        ev_files=["path/to/your/ev1.txt", "path/to/your/ev2.txt", "path/to/your/ev3.txt"],
+        ev_names=["EV1", "EV2", "EV3"],
+        contrasts={
+            "Contrast 1": [1, 0, 0],
+            "Contrast 2": [0, 1, 0],
+            "Contrast 3": [0, 0, 1]
+        }
+    )    
+    """
+    # Checking the file path for the design
+    utilities.check_directory_exists(fsf_dir)
+
+    fsf_content = render_lowlvl_fsf(fsf_dir, input_file, output_dir, confound_file, tr, total_volumes,
+                                    ev_files, ev_names, contrasts, prethresh_masking, delete_volumes,
+                                    high_pass_filter, film_prewhitening, add_motion_parameters,
+                                    thresholding, cluster_z, cluster_p, timeseries_plot, orthogonalise)
+
     with open(fsf_dir + "/design.fsf", "w") as file:
         file.write(fsf_content)
     
     # Print if successfully completed
-    print("FSF file generated successfully.")
\ No newline at end of file
+    print("FSF file generated successfully.")
+
+# ----- render_lowlvl_fsf -----
+def render_lowlvl_fsf(fsf_dir,
+                      input_file,
+                      output_dir,
+                      confound_file,
+                      tr,
+                      total_volumes,
+                      ev_files,
+                      ev_names,
+                      contrasts,
+                      prethresh_masking,
+                      delete_volumes = 0,
+                      high_pass_filter = 100,
+                      film_prewhitening = True,
+                      add_motion_parameters = True,
+                      thresholding = "Cluster",
+                      cluster_z = 3.1,
+                      cluster_p = 0.05,
+                      timeseries_plot = True,
+                      orthogonalise = None,
+                      check_output_dir = True):
+    """
+    Renders the text of a first level .fsf file without writing it.
+
+    Takes the same parameters as lowlvl_fsf, so the same job dictionaries work for both;
+    fsf_dir is accepted but neither checked nor written to. With check_output_dir set to
+    False, output_dir need not exist either (e.g., for designs stored in a bundle).
+
+    Returns:
+    str: The .fsf file contents.
+    """
+    design = _prepare_lowlvl(input_file, output_dir, confound_file, tr,
+                             total_volumes, ev_files, ev_names, delete_volumes, check_output_dir)
+    swept = _swept_fields(high_pass_filter, cluster_z, cluster_p, thresholding, film_prewhitening)
+    return _render_lowlvl(design, output_dir, ev_files, ev_names, contrasts, prethresh_masking,
+                          add_motion_parameters, timeseries_plot, swept, orthogonalise)
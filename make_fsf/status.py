@@ -0,0 +1,231 @@
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import bids
+
+# Job states, from least to most finished
+NOT_STARTED = "not started"
+RUNNING = "running"
+FAILED = "failed"
+COMPLETE = "complete"
+
+# FEAT writes the post-stats report last, so its presence means the job is (nearly) finished
+COMPLETE_MARKER = "report_poststats.html"
+
+# FEAT's report pages refresh themselves and say so until the whole job has finished
+REPORT_FILES = ["report.html", COMPLETE_MARKER]
+RUNNING_PATTERN = re.compile(r"STILL RUNNING|http-equiv=\"?refresh", re.IGNORECASE)
+
+# Text that FEAT (or fsl_sub error logs) leave behind when a stage fails
+ERROR_PATTERN = re.compile(r"\bERROR\b|Error:|Traceback|command not found")
+
+# ----- _design_output_dir -----
+def _design_output_dir(design_file):
+    """
+    Reads fmri(outputdir) from a design file.
+
+    Parameters:
+    design_file (str): The path to the .fsf file.
+
+    Returns:
+    str: The output directory, or None if the design does not set one.
+    """
+    with open(design_file) as file:
+        match = re.search(r'^set fmri\(outputdir\) "([^"]*)"', file.read(), re.MULTILINE)
+    return match.group(1) if match else None
+
+# ----- _resolve_feat_dir -----
+def _resolve_feat_dir(output_dir):
+    """
+    Finds the .feat directory FEAT created for an output directory.
+
+    FEAT appends ".feat" to the output directory and, if that already exists, adds "+" signs
+    (e.g., run+.feat), so the most recent run is the one with the most.
+
+    Parameters:
+    output_dir (str): The fmri(outputdir) value.
+
+    Returns:
+    str: The path of the latest .feat directory, or None if FEAT has not created one.
+    """
+    base = output_dir[:-len(".feat")] if output_dir.endswith(".feat") else output_dir
+
+    # Stat-ing the candidates directly avoids listing a parent shared by thousands of jobs
+    latest = None
+    plus = ""
+    while os.path.isdir(f"{base}{plus}.feat"):
+        latest = f"{base}{plus}.feat"
+        plus += "+"
+    return latest
+
+# ----- _has_errors -----
+def _has_errors(feat_dir):
+    """
+    Looks for signs of failure in a .feat directory's report log and error logs.
+
+    Parameters:
+    feat_dir (str): The path to the .feat directory.
+
+    Returns:
+    bool: Whether an error was found.
+    """
+    candidates = [os.path.join(feat_dir, "report_log.html")]
+    try:
+        with os.scandir(os.path.join(feat_dir, "logs")) as entries:
+            candidates.extend(entry.path for entry in entries if ".e" in entry.name or entry.name.endswith("_err"))
+    except OSError:
+        pass
+
+    for path in candidates:
+        try:
+            with open(path, errors="replace") as file:
+                if ERROR_PATTERN.search(file.read()):
+                    return True
+        except OSError:
+            continue
+    return False
+
+# ----- _report_finished -----
+def _report_finished(feat_dir):
+    """
+    Confirms from FEAT's report pages that a job has finished, rather than only started its last stage.
+
+    Parameters:
+    feat_dir (str): The path to the .feat directory.
+
+    Returns:
+    bool: Whether no report page still marks the job as running.
+    """
+    for name in REPORT_FILES:
+        try:
+            with open(os.path.join(feat_dir, name), errors="replace") as file:
+                if RUNNING_PATTERN.search(file.read()):
+                    return False
+        except OSError:
+            continue
+    return True
+
+# ----- job_status -----
+def job_status(design_file, stale_after=None):
+    """
+    Classifies the FEAT job of a design file from the files in its output directory.
+
+    Parameters:
+    design_file (str): The path to the .fsf file.
+    stale_after (float): Seconds without any change after which an unfinished job counts as failed. Default is None, which never does.
+
+    Returns:
+    dict: "design_file", "output_dir", "feat_dir", "status" and "checked" (a Unix time).
+    """
+    record = {"design_file": design_file,
+              "output_dir": None,
+              "feat_dir": None,
+              "status": NOT_STARTED,
+              "checked": time.time()}
+    try:
+        record["output_dir"] = _design_output_dir(design_file)
+    except OSError as e:
+        print(f"Error reading {design_file}: {e}")
+        return record
+    if record["output_dir"] is None:
+        return record
+
+    feat_dir = _resolve_feat_dir(record["output_dir"])
+    if feat_dir is None:
+        return record
+    record["feat_dir"] = feat_dir
+
+    # A single scandir answers both "has it reached its last stage?" and "when did it last change?"
+    latest_change = 0.0
+    finished = False
+    try:
+        with os.scandir(feat_dir) as entries:
+            for entry in entries:
+                if entry.name == COMPLETE_MARKER:
+                    finished = True
+                try:
+                    latest_change = max(latest_change, entry.stat().st_mtime)
+                except OSError:
+                    continue
+    except OSError as e:
+        # The directory may have been removed (e.g., by a re-run) since it was found
+        print(f"Error scanning {feat_dir}: {e}")
+        record["feat_dir"] = None
+        return record
+
+    # Errors are checked first, since a failed job may still have written its post-stats report
+    if _has_errors(feat_dir):
+        record["status"] = FAILED
+    elif finished and _report_finished(feat_dir):
+        record["status"] = COMPLETE
+    elif stale_after is not None and record["checked"] - latest_change > stale_after:
+        record["status"] = FAILED
+    else:
+        record["status"] = RUNNING
+    return record
+
+# ----- _find_designs -----
+def _find_designs(fsf_root):
+    """
+    Lists every .fsf file beneath a directory.
+
+    Parameters:
+    fsf_root (str): The directory to search.
+
+    Returns:
+    list: Sorted paths of .fsf files.
+    """
+    return sorted(os.path.join(directory, name)
+                  for directory, name in bids._walk_files(fsf_root)
+                  if name.endswith(".fsf"))
+
+# ----- scan_status -----
+def scan_status(designs, index_file=None, stale_after=None, max_workers=16):
+    """
+    Scans the FEAT output directories of many designs in parallel and classifies each job.
+
+    When an index file is given, jobs it already records as complete are not revisited and
+    the updated index is written back, so repeated scans only touch unfinished jobs.
+
+    Parameters:
+    designs (str or list): A directory to search for .fsf files, or a list of .fsf paths.
+    index_file (str): The path of a JSON file holding earlier results. Default is None.
+    stale_after (float): Seconds without any change after which an unfinished job counts as failed. Default is None.
+    max_workers (int): The number of threads scanning directories. Default is 16.
+
+    Returns:
+    dict: Design file paths mapped to their job_status records.
+
+    Example:
+    index = scan_status("path/to/fsfs", index_file="path/to/status.json")
+    """
+    design_files = _find_designs(designs) if isinstance(designs, str) else list(designs)
+
+    index = {}
+    if index_file is not None and os.path.exists(index_file):
+        with open(index_file) as file:
+            index = json.load(file)
+
+    # Finished jobs do not change, so only the rest are scanned again
+    todo = [design for design in design_files
+            if index.get(design, {}).get("status") != COMPLETE]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for record in executor.map(lambda design: job_status(design, stale_after), todo):
+            index[record["design_file"]] = record
+
+    if index_file is not None:
+        # Writing to a temporary file first so an interrupted scan never corrupts the index
+        temporary = index_file + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(index, file, indent=1)
+        os.replace(temporary, index_file)
+
+    counts = {}
+    for design in design_files:
+        status = index[design]["status"]
+        counts[status] = counts.get(status, 0) + 1
+    print(", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+
+    return {design: index[design] for design in design_files}
@@ -0,0 +1,192 @@
+import csv
+import inspect
+import itertools
+import os
+import re
+from . import bundle
+from . import feat_functions
+
+# lowlvl_fsf parameters that a sweep may vary, and the short labels used in design directory names
+SWEEP_PARAMETERS = {"high_pass_filter": "hp",
+                    "cluster_z": "z",
+                    "cluster_p": "p",
+                    "thresholding": "thresh",
+                    "film_prewhitening": "pw"}
+
+# ----- _marker -----
+def _marker(name):
+    """
+    Returns the placeholder written into a rendered template in place of a varying value.
+
+    Parameters:
+    name (str): The name of the value.
+
+    Returns:
+    str: The placeholder.
+    """
+    return f"\x00{name}\x00"
+
+# The _swept_fields value each sweepable parameter is written as
+SWEPT_FIELDS = {"high_pass_filter": "paradigm_hp",
+                "cluster_z": "z_thresh",
+                "cluster_p": "prob_thresh",
+                "thresholding": "thresh",
+                "film_prewhitening": "prewhiten_yn"}
+
+# ----- _lowlvl_defaults -----
+def _lowlvl_defaults():
+    """
+    Returns the default values of lowlvl_fsf's optional parameters.
+
+    Returns:
+    dict: Parameter names mapped to their defaults.
+    """
+    return {name: parameter.default
+            for name, parameter in inspect.signature(feat_functions.lowlvl_fsf).parameters.items()
+            if parameter.default is not inspect.Parameter.empty}
+
+# ----- _label_value -----
+def _label_value(name, fields):
+    """
+    Formats a parameter value for use in a directory name, from the value the design is written with.
+
+    Labelling the written values means two spellings of one value (e.g., 0.05 and "0.05", or
+    "Cluster" and 3) get the same label, so they can be recognised as the same design.
+
+    Parameters:
+    name (str): The parameter name (a SWEEP_PARAMETERS key).
+    fields (dict): The formatted values returned by feat_functions._swept_fields.
+
+    Returns:
+    str: The value with anything but letters, digits, dots and minus signs removed.
+    """
+    value = fields[SWEPT_FIELDS[name]]
+    if name == "thresholding":
+        value = {str(number): label for label, number in feat_functions.THRESHOLDING.items()}[value]
+    return re.sub(r"[^A-Za-z0-9.-]+", "", value)
+
+# ----- _sweep_combinations -----
+def _sweep_combinations(grid):
+    """
+    Expands a parameter grid into every combination, in a deterministic order.
+
+    Every combination is formatted (and so validated) here, before any design is written.
+
+    Parameters:
+    grid (dict): SWEEP_PARAMETERS names mapped to lists of values.
+
+    Returns:
+    list: (label, parameters) tuples, one per combination.
+    """
+    unknown = [name for name in grid if name not in SWEEP_PARAMETERS]
+    if unknown:
+        raise ValueError(f"Only {', '.join(SWEEP_PARAMETERS)} can be swept, not {', '.join(unknown)}.")
+    for name, values in grid.items():
+        if len(values) == 0:
+            raise ValueError(f"The grid for {name} is empty.")
+
+    defaults = _lowlvl_defaults()
+    names = [name for name in SWEEP_PARAMETERS if name in grid]
+    combinations = []
+    labelled = {}
+    for values in itertools.product(*(grid[name] for name in names)):
+        parameters = dict(zip(names, values))
+        fields = feat_functions._swept_fields(**{name: parameters.get(name, defaults[name])
+                                                 for name in SWEEP_PARAMETERS})
+        label = "_".join(f"{SWEEP_PARAMETERS[name]}-{_label_value(name, fields)}" for name in names)
+        if label in labelled:
+            raise ValueError(f"The grid values {labelled[label]} and {parameters} give the same design ({label}).")
+        labelled[label] = parameters
+        combinations.append((label, parameters))
+    return combinations
+
+# ----- sweep_fsf -----
+def sweep_fsf(jobs, grid, manifest_file, bundle_file=None):
+    """
+    Generates first level .fsf files for every combination of a parameter grid, for every job.
+
+    Each job is validated, probed and rendered once; only the swept values and the output
+    directory are filled in per combination. Designs are written to
+    <fsf_dir>/<label>/design.fsf and point FEAT at <output_dir>/<label>, where the label
+    spells out the combination (e.g., "hp-100_z-3.1").
+
+    Parameters:
+    jobs (iterable): Dictionaries of lowlvl_fsf keyword arguments (e.g., from bids.bids_jobs).
+    grid (dict): Any of high_pass_filter, cluster_z, cluster_p, thresholding and film_prewhitening mapped to lists of values.
+    manifest_file (str): The path of a .tsv file listing every design and its parameters.
+    bundle_file (str): A design bundle to store the designs in instead of writing files (see bundle.extract_design). Default is None.
+
+    Returns:
+    list: The manifest rows, as dictionaries.
+
+    Example:
+    sweep_fsf(bids_jobs("path/to/bids", "path/to/fsfs", "path/to/feats", "path/to/evs"),
+              grid={"high_pass_filter": [90, 128], "cluster_z": [2.3, 3.1]},
+              manifest_file="path/to/manifest.tsv")
+    """
+    combinations = _sweep_combinations(grid)
+
+    # Non-swept parameters fall back to lowlvl_fsf's own defaults
+    defaults = _lowlvl_defaults()
+
+    connection = bundle.open_bundle(bundle_file) if bundle_file is not None else None
+
+    rows = []
+    try:
+        for job in jobs:
+            params = {**defaults, **job}
+            design = feat_functions._prepare_lowlvl(params["input_file"], params["output_dir"], params["confound_file"],
+                                                    params["tr"], params["total_volumes"], params["ev_files"],
+                                                    params["ev_names"], params["delete_volumes"],
+                                                    check_output_dir=connection is None)
+
+            # Rendering everything once, with placeholders where the combinations differ
+            fields = ["paradigm_hp", "z_thresh", "prob_thresh", "thresh", "prewhiten_yn"]
+            template = feat_functions._render_lowlvl(design, _marker("output_dir"), params["ev_files"],
+                                                     params["ev_names"], params["contrasts"],
+                                                     params["prethresh_masking"], params["add_motion_parameters"],
+                                                     params["timeseries_plot"], {field: _marker(field) for field in fields},
+                                                     params["orthogonalise"])
+
+            # Even pieces are fixed text, odd pieces are the names of the values to fill in
+            pieces = re.split("\x00(\\w+)\x00", template)
+            bundled = []
+
+            for label, parameters in combinations:
+                swept = {**params, **parameters}
+                values = feat_functions._swept_fields(swept["high_pass_filter"], swept["cluster_z"],
+                                                      swept["cluster_p"], swept["thresholding"],
+                                                      swept["film_prewhitening"])
+                values["output_dir"] = os.path.join(params["output_dir"], label)
+                fsf_content = "".join(values[piece] if n % 2 else piece for n, piece in enumerate(pieces))
+
+                design_dir = os.path.join(params["fsf_dir"], label)
+                design_file = os.path.join(design_dir, "design.fsf")
+                if connection is not None:
+                    bundled.append((design_file, fsf_content))
+                else:
+                    os.makedirs(design_dir, exist_ok=True)
+                    with open(design_file, "w") as file:
+                        file.write(fsf_content)
+
+                rows.append({"design_file": design_file,
+                             "output_dir": values["output_dir"],
+                             "input_file": ";".join(design["input_files"]),
+                             **{name: swept[name] for name in SWEEP_PARAMETERS}})
+
+            # Committing each job's designs together, so an interrupted sweep keeps every finished job
+            if connection is not None:
+                bundle.add_designs(connection, bundled)
+    finally:
+        if connection is not None:
+            connection.close()
+
+    with open(manifest_file, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=["design_file", "output_dir", "input_file", *SWEEP_PARAMETERS],
+                                delimiter="\t")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    # Print if successfully completed
+    print(f"{len(rows)} FSF files generated successfully.")
+    return rows
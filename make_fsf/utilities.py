@@ -1,18 +1,63 @@
+import functools
+import json
 import nibabel as nib
+import numpy as np
 import os
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import archives
+
+# Time units that a NIfTI header may declare for pixdim[4], as multiples of a second
+TIME_UNITS = {"sec": 1.0, "msec": 1e-3, "usec": 1e-6}
+
+# The largest difference, in seconds, at which two TRs still count as the same
+TR_TOLERANCE = 1e-3
 
 # ----- check_directory_exists
 def check_directory_exists(file_path):
-    if not os.path.isdir(file_path):
+    if archives.split_archive_path(file_path) is not None:
+        if not archives.member_exists(file_path):
+            raise FileNotFoundError(f"The directory or file {file_path} does not exist.")
+    elif not os.path.exists(file_path):
         raise FileNotFoundError(f"The directory or file {file_path} does not exist.")
 
+# ----- _nifti_header -----
+def _nifti_header(input_file):
+    """
+    Reads the header of a NIfTI file, or of a NIfTI member inside a tar/zip archive.
+
+    Parameters:
+    input_file (str): The path to the .nii.gz file, or an archive-member path ("archive.tar::member.nii.gz").
+
+    Returns:
+    nibabel.Nifti1Header or nibabel.Nifti2Header: The header.
+    """
+    if archives.split_archive_path(input_file) is not None:
+        return archives.nifti_header(input_file)
+    return nib.load(input_file).header
+
+# ----- _vols_from_header -----
+def _vols_from_header(header):
+    """
+    Reads the number of volumes from a NIfTI header.
+
+    Parameters:
+    header (nibabel.Nifti1Header): The header.
+
+    Returns:
+    int: The number of volumes.
+    """
+    shape = header.get_data_shape()
+    return shape[-1]  # Assuming last dimension represents time points
+
 # ----- vols_from_nifti -----
 def vols_from_nifti(input_file):
     """
     Reads the number of volumes from a NIfTI file.
 
     Parameters:
-    input_file (str): The path to the .nii.gz file.
+    input_file (str): The path to the .nii.gz file, or an archive-member path ("archive.tar::member.nii.gz").
 
     Returns:
     float: The number of volumes within the .nii.gz file, or None if not found.
@@ -20,70 +65,452 @@ def vols_from_nifti(input_file):
     check_directory_exists(input_file)
     
     try:
-        nifti = nib.load(input_file)
-        data = nifti.get_fdata()
-        num_volumes = data.shape[-1]  # Assuming last dimension represents time points
-        return num_volumes
+        # The shape comes from the header, so the image data is never read
+        return _vols_from_header(_nifti_header(input_file))
     
     except Exception as e:
         print(f"Error loading or processing {input_file}: {e}")
         return None
 
+# ----- _tr_from_header -----
+def _tr_from_header(header):
+    """
+    Reads the repetition time (TR) from a NIfTI header.
+
+    Parameters:
+    header (nibabel.Nifti1Header): The header.
+
+    Returns:
+    float: The repetition time (TR) in seconds, or None if not found.
+    """
+    # Check if TR information is available in the header
+    if 'pixdim' in header:
+        # The TR is usually stored in the pixdim[4] element
+        tr = float(header['pixdim'][4])
+
+        # Some scanners store pixdim[4] in milliseconds; xyzt_units says so
+        tr *= TIME_UNITS.get(header.get_xyzt_units()[1], 1.0)
+        
+        # Return the TR value if it is greater than zero
+        if tr > 0:
+            return tr
+        else:
+            print("TR value is not greater than zero.")
+            return None
+    else:
+        print("TR information not found in the header.")
+        return None
+
 # ----- tr_from_nifti -----
 def tr_from_nifti(input_file):
     """
     Reads the repetition time (TR) from a NIfTI file.
 
     Parameters:
-    input_file (str): The path to the .nii.gz file.
+    input_file (str): The path to the .nii.gz file, or an archive-member path ("archive.tar::member.nii.gz").
 
     Returns:
     float: The repetition time (TR) in seconds, or None if not found.
     """   
-    if not os.path.exists(input_file):
-        raise FileNotFoundError(f"The input file {input_file} does not exist.")
+    check_directory_exists(input_file)
   
     try:
-        # Load the NIfTI file
-        img = nib.load(input_file)
-        
-        # Get the header information
-        header = img.header
-        
-        # Check if TR information is available in the header
-        if 'pixdim' in header:
-            # The TR is usually stored in the pixdim[4] element
-            tr = header['pixdim'][4]
-            
-            # Return the TR value if it is greater than zero
-            if tr > 0:
-                return tr
-            else:
-                print("TR value is not greater than zero.")
-                return None
-        else:
-            print("TR information not found in the header.")
-            return None
+        # Get the header information (without loading the image data)
+        return _tr_from_header(_nifti_header(input_file))
     except Exception as e:
         print(f"An error occurred while reading the NIfTI file: {e}")
         return None
     
+# ----- _voxels_from_header -----
+def _voxels_from_header(header):
+    """
+    Reads the number of voxels from a NIfTI header.
+
+    Parameters:
+    header (nibabel.Nifti1Header): The header.
+
+    Returns:
+    int: The number of voxels.
+    """
+    return int(np.prod(header.get_data_shape()))  # Total number of elements in the data array
+
 # ----- voxels_from_nifti -----
 def voxels_from_nifti(input_file):
     """
     Reads the number of voxels contained within a NIfTI file.
 
     Parameters:
-    input_file (str): The path to the .nii.gz file.
+    input_file (str): The path to the .nii.gz file, or an archive-member path ("archive.tar::member.nii.gz").
 
     Returns:
     float: The number of voxels contained, or None if not found.
     """   
     try:
-        nifti = nib.load(input_file)
-        data = nifti.get_fdata()
-        num_voxels = data.size  # Total number of elements in the data array
-        return num_voxels
+        return _voxels_from_header(_nifti_header(input_file))
     except Exception as e:
         print(f"Error loading or processing {input_file}: {e}")
         return None
+
+# ----- _parse_bids_name -----
+def _parse_bids_name(file_name):
+    """
+    Splits a BIDS file name into its entities and suffix.
+
+    Parameters:
+    file_name (str): The file name, without its directory.
+
+    Returns:
+    tuple: A dictionary of entities (e.g., {"sub": "01"}) and the suffix (e.g., "bold").
+    """
+    stem = file_name.split(".", 1)[0]
+    parts = stem.split("_")
+    entities = dict(part.split("-", 1) for part in parts[:-1] if "-" in part)
+    return entities, parts[-1]
+
+# ----- _read_json -----
+def _read_json(path):
+    """
+    Reads and parses a JSON file.
+
+    Parameters:
+    path (str): The path to the JSON file.
+
+    Returns:
+    The parsed content.
+    """
+    with open(path) as file:
+        return json.load(file)
+
+# ----- _directory_sidecars -----
+@functools.lru_cache(maxsize=None)
+def _directory_sidecars(directory, generation=0):
+    """
+    Reads and parses every JSON sidecar in a directory once; later calls come from the cache.
+
+    Parameters:
+    directory (str): The directory to index, or a directory inside an archive ("archive.tar::sub-01/func").
+    generation (int): The cache generation, so a parse that raced with clear_caches is never reused. Default is 0.
+
+    Returns:
+    tuple: (entities, suffix, metadata) for each sidecar the directory holds.
+    """
+    sidecars = []
+    try:
+        # Sidecars inside an archive are read from the bytes captured when it was indexed
+        if archives.split_archive_path(directory) is not None:
+            paths = [path for path in archives.list_members(directory) if path.endswith(".json")]
+            read = lambda path: json.loads(archives.read_member_prefix(path, archives.SIDECAR_BYTES))
+        else:
+            with os.scandir(directory) as entries:
+                paths = [entry.path for entry in entries if entry.name.endswith(".json") and entry.is_file()]
+            read = _read_json
+
+        for path in paths:
+            name = path.rsplit("/", 1)[-1].rsplit(archives.ARCHIVE_SEPARATOR, 1)[-1]
+            if name == "dataset_description.json":
+                continue
+            try:
+                metadata = read(path)
+            except (OSError, ValueError) as e:
+                print(f"Error reading sidecar {path}: {e}")
+                continue
+            entities, suffix = _parse_bids_name(name)
+            sidecars.append((entities, suffix, metadata))
+    except OSError as e:
+        print(f"Error scanning {directory}: {e}")
+
+    # Fewer entities means less specific, so those are applied first
+    sidecars.sort(key=lambda sidecar: len(sidecar[0]))
+    return tuple(sidecars)
+
+# ----- _is_dataset_root -----
+def _is_dataset_root(directory):
+    """
+    Checks whether a directory is the root of a BIDS dataset (holds dataset_description.json).
+
+    Parameters:
+    directory (str): A directory, or a directory inside an archive ("archive.tar::sub-01/func").
+
+    Returns:
+    bool: Whether the directory is a dataset root.
+    """
+    parts = archives.split_archive_path(directory)
+    if parts is not None:
+        member_dir = parts[1].rstrip("/")
+        description = posixpath.join(member_dir, "dataset_description.json") if member_dir else "dataset_description.json"
+        return archives.member_exists(f"{parts[0]}{archives.ARCHIVE_SEPARATOR}{description}")
+    return os.path.isfile(os.path.join(directory, "dataset_description.json"))
+
+# ----- _parent_directory -----
+def _parent_directory(directory):
+    """
+    Returns the directory above another, stepping from the top of an archive to the directory holding it.
+
+    Parameters:
+    directory (str): A directory, or a directory inside an archive ("archive.tar::sub-01/func").
+
+    Returns:
+    str: The parent directory.
+    """
+    parts = archives.split_archive_path(directory)
+    if parts is None:
+        return os.path.dirname(directory)
+    archive, member_dir = parts
+    member_dir = member_dir.rstrip("/")
+    if member_dir:
+        return f"{archive}{archives.ARCHIVE_SEPARATOR}{posixpath.dirname(member_dir)}"
+    return os.path.dirname(archive)
+
+# ----- sidecar_metadata -----
+def sidecar_metadata(input_file):
+    """
+    Collects the JSON sidecar metadata of a BIDS file by following the inheritance principle.
+
+    Parameters:
+    input_file (str): The path to the .nii.gz file, or an archive-member path ("archive.tar::member.nii.gz").
+
+    Returns:
+    dict: The merged metadata, with more specific sidecars overriding less specific ones.
+    """
+    # Climbing from the file's directory to the dataset root (or only the file's directory if there is none);
+    # inside an archive, the climb continues from the top of the archive into the directory holding it
+    parts = archives.split_archive_path(input_file)
+    if parts is not None:
+        archive, member = parts
+        entities, suffix = _parse_bids_name(posixpath.basename(member))
+        directory = f"{os.path.abspath(archive)}{archives.ARCHIVE_SEPARATOR}{posixpath.dirname(member)}"
+    else:
+        entities, suffix = _parse_bids_name(os.path.basename(input_file))
+        directory = os.path.dirname(os.path.abspath(input_file))
+    # The root is found before any sidecar is parsed, so a file outside a dataset never has
+    # every .json in its ancestors (up to /) read only to be discarded
+    directories = [directory]
+    is_root = _is_dataset_root(directory)
+    while not is_root:
+        parent = _parent_directory(directories[-1])
+        if parent == directories[-1] or not parent:
+            break
+        directories.append(parent)
+        is_root = _is_dataset_root(parent)
+    if not is_root:
+        directories = directories[:1]
+    levels = [_directory_sidecars(directory, _CACHE_GENERATION) for directory in directories]
+
+    metadata = {}
+    for sidecars in reversed(levels):
+        for sidecar_entities, sidecar_suffix, sidecar_data in sidecars:
+            if sidecar_suffix != suffix:
+                continue
+            if all(entities.get(key) == value for key, value in sidecar_entities.items()):
+                metadata.update(sidecar_data)
+    return metadata
+
+# ----- tr_from_sidecar -----
+def tr_from_sidecar(input_file):
+    """
+    Reads the repetition time (TR) from the BIDS JSON sidecar(s) of a NIfTI file.
+
+    Parameters:
+    input_file (str): The path to the .nii.gz file, or an archive-member path ("archive.tar::member.nii.gz").
+
+    Returns:
+    float: The repetition time (TR) in seconds, or None if not found.
+    """
+    tr = sidecar_metadata(input_file).get("RepetitionTime")
+    try:
+        tr = float(tr)
+    except (TypeError, ValueError):
+        return None
+    return tr if tr > 0 else None
+
+# ----- resolve_tr -----
+def resolve_tr(input_file):
+    """
+    Resolves the repetition time (TR) from the BIDS sidecar, falling back to the NIfTI header.
+
+    Parsed sidecars are cached for the life of the process; call clear_caches after editing
+    them (watch mode does so automatically).
+
+    Parameters:
+    input_file (str): The path to the .nii.gz file, or an archive-member path ("archive.tar::member.nii.gz").
+
+    Returns:
+    float: The repetition time (TR) in seconds, or None if not found.
+    """
+    tr = tr_from_sidecar(input_file)
+    if tr is None:
+        tr = tr_from_nifti(input_file)
+    return tr
+
+# ----- check_tr_consistency -----
+def check_tr_consistency(input_files, tolerance=TR_TOLERANCE):
+    """
+    Compares the sidecar and header TR of every file and flags those that disagree.
+
+    Parameters:
+    input_files (list): Paths to .nii.gz files.
+    tolerance (float): The largest difference, in seconds, treated as agreement. Default is 0.001.
+
+    Returns:
+    list: A dictionary ("file", "sidecar_tr", "header_tr") for each file whose TRs differ or are missing.
+    """
+    mismatches = []
+    for input_file in input_files:
+        sidecar_tr = tr_from_sidecar(input_file)
+        header_tr = tr_from_nifti(input_file)
+        if sidecar_tr is None or header_tr is None or abs(sidecar_tr - header_tr) > tolerance:
+            mismatches.append({"file": input_file,
+                               "sidecar_tr": sidecar_tr,
+                               "header_tr": header_tr})
+    return mismatches
+
+# ----- _iter_volumes -----
+def _iter_volumes(input_file, n_volumes=None):
+    """
+    Yields the volumes of a 4D NIfTI file one at a time, flattened, without loading the whole run.
+
+    Parameters:
+    input_file (str): The path to the .nii or .nii.gz file.
+    n_volumes (int): The number of leading volumes to read. Default is None, which reads them all.
+
+    Returns:
+    generator: One 1D array per volume (none for a file that is not 4D).
+    """
+    nifti = nib.load(input_file)
+    shape = nifti.shape
+
+    # A 3D image has no time axis, so there are no volumes to stream
+    if len(shape) != 4:
+        return
+    total = shape[-1]
+    if n_volumes is None or n_volumes > total:
+        n_volumes = total
+
+    # Data is Fortran ordered, so each volume is one contiguous block
+    # (the proxy's offset is used because nibabel may write vox_offset as 0)
+    dtype = nifti.header.get_data_dtype()
+    n_voxels = int(np.prod(shape[:3]))
+    offset = int(nifti.dataobj.offset)
+    slope, inter = nifti.dataobj.slope, nifti.dataobj.inter
+
+    # A single handle reads the volumes in order (a .nii.gz is decompressed once) and is closed when done
+    with nib.openers.ImageOpener(input_file) as file:
+        file.seek(offset)
+        for _ in range(n_volumes):
+            volume = np.frombuffer(file.read(n_voxels * dtype.itemsize), dtype=dtype)
+            yield volume.astype(float) * slope + inter
+
+# ----- dummies_from_nifti -----
+def dummies_from_nifti(input_file, max_dummies=10, window=50, threshold=3.5):
+    """
+    Detects leading non-steady-state (dummy) volumes from the global signal of a NIfTI file.
+
+    Volumes are streamed one at a time; a leading volume counts as a dummy while its mean
+    signal is a positive outlier (modified z-score above the threshold) among the first volumes.
+
+    Parameters:
+    input_file (str): The path to the .nii or .nii.gz file.
+    max_dummies (int): The largest number of dummy volumes to report. Default is 10.
+    window (int): The number of leading volumes used to estimate the steady state. Default is 50.
+    threshold (float): The modified z-score above which a volume is an outlier. Default is 3.5.
+
+    Returns:
+    int: The number of leading dummy volumes, or None if the file could not be read.
+    """
+    check_directory_exists(input_file)
+
+    try:
+        global_signal = np.array([volume.mean() for volume in _iter_volumes(input_file, window)])
+    except Exception as e:
+        print(f"Error loading or processing {input_file}: {e}")
+        return None
+
+    if global_signal.size == 0:
+        return 0
+
+    median = np.median(global_signal)
+    mad = np.median(np.abs(global_signal - median))
+    if mad == 0:
+        return 0
+    outliers = 0.6745 * (global_signal - median) / mad > threshold
+
+    # Counting the outliers before the first steady-state volume
+    n_dummies = int(np.argmin(outliers)) if not outliers.all() else len(outliers)
+    return min(n_dummies, max_dummies)
+
+# Probe results keyed by file path, alongside the (mtime, size) and cache generation they were read at
+_PROBE_CACHE = {}
+
+# Bumped by clear_caches; results read under an older generation (e.g., by a thread that was
+# parsing a sidecar while it was edited) are never reused
+_CACHE_GENERATION = 0
+
+# ----- clear_caches -----
+def clear_caches():
+    """
+    Forgets every cached probe result and parsed sidecar (e.g., after sidecars were edited).
+
+    Returns:
+    None
+    """
+    global _CACHE_GENERATION
+    _CACHE_GENERATION += 1
+    _PROBE_CACHE.clear()
+    _directory_sidecars.cache_clear()
+
+# ----- probe_nifti -----
+def probe_nifti(input_file, detect_dummies=False):
+    """
+    Reads the TR, number of volumes and number of voxels of a NIfTI file without loading its data.
+
+    Parameters:
+    input_file (str): The path to the .nii.gz file, or an archive-member path ("archive.tar::member.nii.gz").
+    detect_dummies (bool): Whether to also stream the file to count dummy volumes. Default is False.
+
+    Returns:
+    dict: "file", "tr", "volumes", "voxels" and "dummies"; any value that cannot be read (or was not requested) is None.
+    """
+    check_directory_exists(input_file)
+
+    # Reusing an earlier probe while the file (or the archive holding it) is unchanged and no cache was cleared
+    parts = archives.split_archive_path(input_file)
+    stat = os.stat(parts[0] if parts is not None else input_file)
+    stamp = (stat.st_mtime_ns, stat.st_size, _CACHE_GENERATION)
+    cached = _PROBE_CACHE.get(input_file)
+    if cached is not None and cached[0] == stamp and (cached[1]["dummies"] is not None or not detect_dummies):
+        return dict(cached[1])
+
+    # Reading the header once for the TR, volumes and voxels
+    probe = {"file": input_file, "tr": tr_from_sidecar(input_file), "volumes": None, "voxels": None}
+    try:
+        header = _nifti_header(input_file)
+        if probe["tr"] is None:
+            probe["tr"] = _tr_from_header(header)
+        probe["volumes"] = _vols_from_header(header)
+        probe["voxels"] = _voxels_from_header(header)
+    except Exception as e:
+        print(f"Error loading or processing {input_file}: {e}")
+    probe["dummies"] = dummies_from_nifti(input_file) if detect_dummies else None
+    _PROBE_CACHE[input_file] = (stamp, probe)
+    return dict(probe)
+
+# Set on threads that already belong to a bounded pool (see aio), where probing must not start more threads
+_SERIAL = threading.local()
+
+# ----- probe_niftis -----
+def probe_niftis(input_files, detect_dummies=False, max_workers=None):
+    """
+    Probes several NIfTI files concurrently (or one after another on a thread of an already bounded pool).
+
+    Parameters:
+    input_files (list): Paths to .nii.gz files.
+    detect_dummies (bool): Whether to also count dummy volumes. Default is False.
+    max_workers (int): The number of threads to use. Default is None, which lets Python decide.
+
+    Returns:
+    list: The probe_nifti dictionary of each file, in the order given.
+    """
+    if len(input_files) == 1 or getattr(_SERIAL, "active", False):
+        return [probe_nifti(input_file, detect_dummies) for input_file in input_files]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda input_file: probe_nifti(input_file, detect_dummies), input_files))
@@ -0,0 +1,336 @@
+import os
+import queue
+import threading
+import time
+from . import bids
+from . import feat_functions
+from . import utilities
+
+# ----- _watched -----
+def _watched(name):
+    """
+    Checks whether a file is one the designs depend on.
+
+    Parameters:
+    name (str): The file name.
+
+    Returns:
+    bool: Whether the file is a BOLD run, events file, JSON sidecar or fMRIPrep confounds file.
+    """
+    return (name.endswith((bids.BOLD_SUFFIX, bids.EVENTS_SUFFIX, ".json"))
+            or bids._confounds_suffix(name) is not None)
+
+# ----- _scan_directory -----
+def _scan_directory(directory, skip_dirs):
+    """
+    Lists one directory, taking the watched files' stat results from its os.scandir entries.
+
+    Parameters:
+    directory (str): The directory to list.
+    skip_dirs (iterable): Subdirectory names to leave unvisited.
+
+    Returns:
+    tuple: (files, subdirectories), where files maps paths to (mtime_ns, size) tuples.
+    """
+    files = {}
+    subdirs = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in skip_dirs:
+                        subdirs.append(entry.path)
+                elif _watched(entry.name):
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                continue
+    return files, subdirs
+
+# ----- _snapshot -----
+def _snapshot(bids_dir, fmriprep_dir=None, directories=None, settle=0.0, full=True):
+    """
+    Records the (mtime, size) of every file the designs depend on.
+
+    Given the per-directory state of the previous snapshot, only directories whose mtime
+    changed (files added, removed or renamed), or that changed within the last settle seconds
+    (files possibly still being written), are listed again; the rest cost one os.stat each.
+    A full snapshot lists every directory, catching files rewritten in place.
+
+    Parameters:
+    bids_dir (str): The root of the BIDS dataset.
+    fmriprep_dir (str): The root of an fMRIPrep derivatives tree. Default is None.
+    directories (dict): The per-directory state of the previous snapshot, updated in place. Default is None.
+    settle (float): Seconds a changed directory keeps being listed. Default is 0.0.
+    full (bool): Whether to list every directory regardless of the previous state. Default is True.
+
+    Returns:
+    dict: File paths mapped to (mtime_ns, size) tuples.
+    """
+    if directories is None:
+        directories = {}
+    now = time.monotonic()
+
+    files = {}
+    seen = set()
+    stack = [(bids_dir, bids.SKIP_DIRS)]
+    if fmriprep_dir is not None:
+        stack.append((fmriprep_dir, ()))
+
+    while stack:
+        directory, skip_dirs = stack.pop()
+        seen.add(directory)
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            continue
+
+        state = directories.get(directory)
+        if full or state is None or state["mtime"] != mtime or now - state["changed"] < settle:
+            try:
+                listed, subdirs = _scan_directory(directory, skip_dirs)
+            except OSError as e:
+                print(f"Error scanning {directory}: {e}")
+                continue
+            changed = now
+            if state is not None and state["mtime"] == mtime and state["files"] == listed:
+                changed = state["changed"]
+            state = {"mtime": mtime, "changed": changed, "files": listed, "subdirs": subdirs}
+            directories[directory] = state
+
+        files.update(state["files"])
+        stack.extend((subdir, skip_dirs) for subdir in state["subdirs"])
+
+    # Forgetting directories that were removed
+    for directory in directories.keys() - seen:
+        del directories[directory]
+    return files
+
+# ----- _runs_from_snapshot -----
+def _runs_from_snapshot(files):
+    """
+    Pairs the BOLD runs of a snapshot with their events and confounds, as bids.discover_bids does.
+
+    Parameters:
+    files (dict): The snapshot returned by _snapshot.
+
+    Returns:
+    dict: Run keys mapped to dictionaries with "bold", "events" and "confounds" paths.
+    """
+    bolds = {}
+    events = {}
+    confounds = {}
+    for path in files:
+        name = os.path.basename(path)
+        if name.endswith(bids.BOLD_SUFFIX):
+            bolds[bids._run_key(name, bids.BOLD_SUFFIX)] = path
+        elif name.endswith(bids.EVENTS_SUFFIX):
+            events[bids._run_key(name, bids.EVENTS_SUFFIX)] = path
+        else:
+            suffix = bids._confounds_suffix(name)
+            if suffix is not None:
+                confounds[bids._run_key(name, suffix)] = path
+    return bids._pair_runs(bolds, events, confounds)
+
+# ----- _affected_runs -----
+def _affected_runs(changed, runs):
+    """
+    Finds the runs whose designs depend on any of the changed files.
+
+    Parameters:
+    changed (set): Paths of files that were added, modified or removed.
+    runs (dict): The current runs, as returned by _runs_from_snapshot.
+
+    Returns:
+    set: The affected run keys.
+    """
+    # Sidecars are inherited by every run beneath their directory
+    sidecar_dirs = [os.path.dirname(path) + os.sep for path in changed if path.endswith(".json")]
+
+    affected = set()
+    for key, run in runs.items():
+        if run["bold"] in changed or run["events"] in changed or run["confounds"] in changed:
+            affected.add(key)
+        elif any(run["bold"].startswith(directory) for directory in sidecar_dirs):
+            affected.add(key)
+    return affected
+
+# ----- watch_bids -----
+def watch_bids(bids_dir,
+               fsf_root,
+               output_root,
+               ev_root,
+               fmriprep_dir=None,
+               contrasts=None,
+               confound_columns=None,
+               prethresh_masking=None,
+               poll_interval=0.2,
+               debounce=0.5,
+               max_queue=64,
+               n_workers=2,
+               full_scan_interval=5.0,
+               generate_existing=False,
+               stop_event=None,
+               **fsf_kwargs):
+    """
+    Watches a BIDS dataset and regenerates the design.fsf of every run whose inputs change.
+
+    The tree is polled every poll_interval seconds, listing only directories whose contents
+    changed (and every directory each full_scan_interval seconds). Files that are added, removed
+    or renamed into place are seen on the next poll, so their runs are regenerated within about
+    poll_interval + debounce seconds; a file rewritten in place leaves its directory unchanged and
+    is only seen by the next full listing, up to full_scan_interval + debounce seconds later.
+    A run is regenerated once its files have been unchanged for debounce seconds, so files still
+    being copied are not read half-written; a run that changes while it is being regenerated is
+    regenerated again afterwards, never by two threads at once.
+    Probe results and converted EV files stay cached between regenerations, and pending runs
+    wait in a queue of at most max_queue entries (polling pauses while it is full).
+
+    Parameters:
+    bids_dir (str): The root of the BIDS dataset.
+    fsf_root (str): The directory under which one design directory per run is created.
+    output_root (str): The directory under which FEAT output directories are placed.
+    ev_root (str): The directory under which the converted EV files are written.
+    fmriprep_dir (str): The root of an fMRIPrep derivatives tree. Default is None.
+    contrasts (dict): Dictionary of contrasts. Default is None, which gives one contrast per EV.
+    confound_columns (list): The fMRIPrep confound columns to keep. Default is the six motion parameters.
+    prethresh_masking (str): The pre-threshold mask. Default is None.
+    poll_interval (float): Seconds between scans of the tree. Default is 0.2.
+    debounce (float): Seconds a run's files must stay unchanged before it is regenerated. Default is 0.5.
+    max_queue (int): The largest number of runs waiting to be regenerated. Default is 64.
+    n_workers (int): The number of threads regenerating designs. Default is 2.
+    full_scan_interval (float): Seconds between polls that list every directory. Default is 5.0.
+    generate_existing (bool): Whether to generate every run already present at start-up. Default is False.
+    stop_event (threading.Event): Stops watching once set. Default is None, which watches until interrupted.
+    **fsf_kwargs: Any further lowlvl_fsf arguments, passed through unchanged.
+
+    Returns:
+    None
+
+    Example:
+    watch_bids("path/to/bids", "path/to/fsfs", "path/to/feats", "path/to/evs",
+               fmriprep_dir="path/to/bids/derivatives/fmriprep")
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    work = queue.Queue(maxsize=max_queue)
+    # Runs queued or being regenerated, and those of them that changed again in the meantime
+    queued = set()
+    dirty = set()
+    lock = threading.Lock()
+    runs = {}
+    ev_cache = {}
+
+    # ----- regenerate -----
+    def regenerate(key):
+        with lock:
+            run = runs.get(key)
+        if run is None:
+            return
+
+        # Converting events and confounds only when they changed since the last conversion
+        ev_dir = os.path.join(ev_root, key)
+        stamp = os.stat(run["events"]).st_mtime_ns
+        cached = ev_cache.get((key, "events"))
+        if cached is not None and cached[0] == (run["events"], stamp):
+            ev_files = cached[1]
+        else:
+            ev_files = bids.events_to_evs(run["events"], ev_dir, prefix=key)
+            ev_cache[(key, "events")] = ((run["events"], stamp), ev_files)
+        if not ev_files:
+            print(f"No events found in {run['events']}; skipping {key}.")
+            return
+
+        confound_file = None
+        if run["confounds"] is not None:
+            stamp = os.stat(run["confounds"]).st_mtime_ns
+            cached = ev_cache.get((key, "confounds"))
+            if cached is not None and cached[0] == (run["confounds"], stamp):
+                confound_file = cached[1]
+            else:
+                confound_file = bids.confounds_to_txt(run["confounds"],
+                                                      os.path.join(ev_dir, f"{key}_confounds.txt"),
+                                                      confound_columns)
+                ev_cache[(key, "confounds")] = ((run["confounds"], stamp), confound_file)
+
+        job = bids._run_job(key, run["bold"], ev_files, confound_file, fsf_root, output_root,
+                            contrasts, prethresh_masking, fsf_kwargs)
+        feat_functions.lowlvl_fsf(**job)
+
+    # ----- worker -----
+    def worker():
+        while True:
+            key = work.get()
+            if key is None:
+                break
+            try:
+                # A run stays in queued until it is done, so no two workers regenerate it at once;
+                # if it changed meanwhile, the same worker regenerates it again
+                while True:
+                    try:
+                        regenerate(key)
+                    except Exception as e:
+                        print(f"Error regenerating the design for {key}: {e}")
+                    with lock:
+                        if key not in dirty:
+                            queued.discard(key)
+                            break
+                        dirty.discard(key)
+            finally:
+                work.task_done()
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(n_workers)]
+    for thread in workers:
+        thread.start()
+
+    directories = {}
+    files = _snapshot(bids_dir, fmriprep_dir, directories)
+    last_full_scan = time.monotonic()
+    with lock:
+        runs.update(_runs_from_snapshot(files))
+    pending = {key: 0.0 for key in runs} if generate_existing else {}
+
+    try:
+        while not stop_event.is_set():
+            now = time.monotonic()
+            full = now - last_full_scan >= full_scan_interval
+            if full:
+                last_full_scan = now
+            current = _snapshot(bids_dir, fmriprep_dir, directories, settle=debounce, full=full)
+            changed = {path for path in current.keys() | files.keys() if current.get(path) != files.get(path)}
+            files = current
+
+            if changed:
+                # Edited sidecars change the TR of every run beneath them, so cached probes are stale
+                if any(path.endswith(".json") for path in changed):
+                    utilities.clear_caches()
+                with lock:
+                    runs.clear()
+                    runs.update(_runs_from_snapshot(files))
+                    affected = _affected_runs(changed, runs)
+                for key in affected:
+                    pending[key] = now
+
+            # Queueing runs whose files have settled; put() blocks while the queue is full
+            for key, last_change in list(pending.items()):
+                if now - last_change < debounce:
+                    continue
+                del pending[key]
+                with lock:
+                    if key in queued:
+                        dirty.add(key)
+                        continue
+                    queued.add(key)
+                work.put(key)
+
+            stop_event.wait(poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for _ in workers:
+            work.put(None)
+        for thread in workers:
+            thread.join()
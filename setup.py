@@ -10,7 +10,8 @@ setup(
     url='https://github.com/wj-mitchell/make_fsf',
     packages=find_packages(),
     install_requires=[
-        nibabel
+        'nibabel',
+        'numpy'
     ],
     classifiers=[
         'Programming Language :: Python :: 3',
@@ -0,0 +1,45 @@
+import json
+import os
+import nibabel as nib
+import numpy as np
+import pytest
+
+# ----- make_nifti -----
+@pytest.fixture
+def make_nifti():
+    """
+    Returns a function writing a small NIfTI file with a given shape and TR.
+    """
+    def make(path, shape=(2, 2, 2, 10), tr=2.0):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        image = nib.Nifti1Image(np.zeros(shape, dtype=np.float32), np.eye(4))
+        image.header["pixdim"][4] = tr
+        nib.save(image, path)
+        return path
+    return make
+
+# ----- bids_dataset -----
+@pytest.fixture
+def bids_dataset(tmp_path, make_nifti):
+    """
+    Writes a two-run BIDS dataset with task-level events and a fMRIPrep confounds file for run 1.
+    """
+    root = tmp_path / "bids"
+    func = root / "sub-01" / "func"
+    func.mkdir(parents=True)
+    (root / "dataset_description.json").write_text(json.dumps({"Name": "test"}))
+    (root / "task-x_bold.json").write_text(json.dumps({"RepetitionTime": 2.0}))
+    (root / "task-x_events.tsv").write_text("onset\tduration\ttrial_type\n"
+                                            "10\t2\tgo\n"
+                                            "0\t2\tgo\n"
+                                            "5\t1\tstop\n"
+                                            "n/a\t1\tstop\n")
+    for run in (1, 2):
+        make_nifti(str(func / f"sub-01_task-x_run-{run}_bold.nii.gz"))
+
+    confounds = root / "derivatives" / "fmriprep" / "sub-01" / "func"
+    confounds.mkdir(parents=True)
+    columns = ["trans_x", "trans_y", "trans_z", "rot_x", "rot_y", "rot_z"]
+    rows = ["\t".join(columns)] + ["\t".join(["0.1"] * 6)] * 10
+    (confounds / "sub-01_task-x_run-1_desc-confounds_timeseries.tsv").write_text("\n".join(rows) + "\n")
+    return root
@@ -0,0 +1,56 @@
+import asyncio
+from make_fsf import aio
+from make_fsf import utilities
+
+def test_designs_are_yielded_as_they_finish_with_errors_as_results(monkeypatch):
+    async def lowlvl_fsf_async(executor=None, **job):
+        await asyncio.sleep(job["delay"])
+        if job["fail"]:
+            raise ValueError(job["fsf_dir"])
+        return job["fsf_dir"]
+    monkeypatch.setattr(aio, "lowlvl_fsf_async", lowlvl_fsf_async)
+    jobs = [{"fsf_dir": "slow", "delay": 0.2, "fail": False},
+            {"fsf_dir": "broken", "delay": 0.0, "fail": True},
+            {"fsf_dir": "fast", "delay": 0.05, "fail": False}]
+
+    async def collect():
+        return [result async for _, result in aio.generate_fsf_async(jobs, max_concurrency=3)]
+    results = asyncio.run(collect())
+
+    assert isinstance(results[0], ValueError)
+    assert results[1:] == ["fast", "slow"]
+
+def test_closing_early_cancels_unfinished_jobs_and_pulls_no_more(monkeypatch):
+    started = []
+    cancelled = []
+
+    async def lowlvl_fsf_async(executor=None, **job):
+        started.append(job["fsf_dir"])
+        try:
+            await asyncio.sleep(job["delay"])
+        except asyncio.CancelledError:
+            cancelled.append(job["fsf_dir"])
+            raise
+        return job["fsf_dir"]
+    monkeypatch.setattr(aio, "lowlvl_fsf_async", lowlvl_fsf_async)
+    jobs = ({"fsf_dir": str(n), "delay": 0.0 if n == 0 else 10.0} for n in range(100))
+
+    async def first():
+        designs = aio.generate_fsf_async(jobs, max_concurrency=2)
+        _, result = await designs.__anext__()
+        await designs.aclose()
+        await asyncio.sleep(0)
+        return result, list(cancelled)
+    result, cancelled_before_exit = asyncio.run(first())
+
+    assert result == "0"
+    assert len(started) <= 3
+    assert cancelled_before_exit == [name for name in started if name != "0"]
+
+def test_multi_run_probes_start_no_threads_of_their_own(tmp_path, make_nifti, monkeypatch):
+    runs = [make_nifti(str(tmp_path / f"run-{run}.nii.gz")) for run in (1, 2)]
+    monkeypatch.setattr(utilities, "ThreadPoolExecutor", None)
+
+    probes = asyncio.run(aio._offload(None, utilities.probe_niftis, runs))
+
+    assert [probe["volumes"] for probe in probes] == [10, 10]
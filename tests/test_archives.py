@@ -0,0 +1,76 @@
+import io
+import json
+import tarfile
+import zipfile
+import pytest
+from make_fsf import archives
+from make_fsf import utilities
+
+# ----- add_bytes -----
+def add_bytes(tar_file, name, data):
+    """
+    Adds a member holding the given bytes to an open tar file.
+    """
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar_file.addfile(info, io.BytesIO(data))
+
+@pytest.fixture(params=["w:gz", "w", "zip"])
+def archive(request, tmp_path, make_nifti):
+    """
+    Writes a dataset with a header-only TR of 0 and a sidecar TR of 1.5 into a tar, tar.gz or zip archive.
+    """
+    bold = make_nifti(str(tmp_path / "bold.nii.gz"), shape=(2, 2, 2, 12), tr=0.0)
+    members = {"ds/dataset_description.json": b"{}",
+               "ds/task-x_bold.json": json.dumps({"RepetitionTime": 1.5}).encode()}
+    if request.param == "zip":
+        path = tmp_path / "ds.zip"
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.write(bold, "ds/sub-01/func/sub-01_task-x_bold.nii.gz")
+            for name, data in members.items():
+                zip_file.writestr(name, data)
+    else:
+        path = tmp_path / ("ds.tar.gz" if request.param == "w:gz" else "ds.tar")
+        with tarfile.open(path, request.param) as tar_file:
+            tar_file.add(bold, "ds/sub-01/func/sub-01_task-x_bold.nii.gz")
+            for name, data in members.items():
+                add_bytes(tar_file, name, data)
+    return str(path)
+
+def test_members_are_probed_in_place(archive):
+    utilities.clear_caches()
+    bold = f"{archive}::ds/sub-01/func/sub-01_task-x_bold.nii.gz"
+
+    probe = utilities.probe_nifti(bold)
+
+    assert probe["volumes"] == 12
+    assert probe["voxels"] == 96
+    assert probe["tr"] == 1.5
+
+def test_member_headers_are_read_without_reopening(archive, monkeypatch):
+    archives.member_index(archive)
+    monkeypatch.setattr(archives, "_member_chunks", None)
+    header = archives.nifti_header(f"{archive}::ds/sub-01/func/sub-01_task-x_bold.nii.gz")
+    assert header.get_data_shape() == (2, 2, 2, 12)
+
+def test_missing_members_are_reported(archive):
+    assert archives.member_exists(f"{archive}::ds/task-x_bold.json")
+    assert not archives.member_exists(f"{archive}::ds/nothing.nii.gz")
+    with pytest.raises(FileNotFoundError):
+        utilities.check_directory_exists(f"{archive}::ds/nothing.nii.gz")
+
+def test_extracted_path_points_next_to_the_archive(tmp_path):
+    path = archives.extracted_path(f"{tmp_path}/ds.tar.gz::ds/bold.nii.gz")
+    assert path == f"{tmp_path}/ds/bold.nii.gz"
+
+def test_member_names_are_normalised(tmp_path, make_nifti):
+    bold = make_nifti(str(tmp_path / "ds" / "sub-01" / "func" / "sub-01_task-x_bold.nii.gz"))
+    archive = tmp_path / "sub-01.tar.gz"
+    with tarfile.open(archive, "w:gz") as tar_file:
+        tar_file.add(bold, "./ds/sub-01/func/sub-01_task-x_bold.nii.gz")
+
+    for member in ("ds/sub-01/func/sub-01_task-x_bold.nii.gz", "./ds/sub-01/func/sub-01_task-x_bold.nii.gz",
+                   "/ds/sub-01//func/sub-01_task-x_bold.nii.gz"):
+        assert utilities.probe_nifti(f"{archive}::{member}")["volumes"] == 10
+    assert archives.list_members(f"{archive}::./ds/sub-01/func") == [
+        f"{archive}::ds/sub-01/func/sub-01_task-x_bold.nii.gz"]
@@ -0,0 +1,65 @@
+import os
+import numpy as np
+import pytest
+from make_fsf import beta_series
+
+# ----- run -----
+@pytest.fixture
+def run(tmp_path, make_nifti):
+    """
+    Writes a run with a three-trial "go" EV and a one-trial "stop" EV, and returns the beta_series_fsf arguments.
+    """
+    (tmp_path / "go.txt").write_text("20\t1\t1\n0\t1\t1\n10\t1\t1\n")
+    (tmp_path / "stop.txt").write_text("5\t1\t1\n")
+    (tmp_path / "fsfs").mkdir()
+    (tmp_path / "feats").mkdir()
+    return {"fsf_root": str(tmp_path / "fsfs"),
+            "input_file": make_nifti(str(tmp_path / "bold.nii.gz")),
+            "output_root": str(tmp_path / "feats"),
+            "confound_file": None,
+            "tr": None,
+            "total_volumes": None,
+            "ev_files": [str(tmp_path / "go.txt"), str(tmp_path / "stop.txt")],
+            "ev_names": ["go", "stop"],
+            "ev_dir": str(tmp_path / "split")}
+
+def test_split_trials_writes_each_trial_and_the_rest(tmp_path, run):
+    trials = beta_series.split_trials(run["ev_files"][0], run["ev_dir"], "go")
+
+    assert [onset for _, _, onset in trials] == [0.0, 10.0, 20.0]
+    trial_file, rest_file, _ = trials[1]
+    np.testing.assert_allclose(np.loadtxt(trial_file, ndmin=2), [[10, 1, 1]])
+    np.testing.assert_allclose(np.loadtxt(rest_file, ndmin=2), [[0, 1, 1], [20, 1, 1]])
+
+def test_a_single_trial_has_no_rest(run):
+    [(_, rest_file, onset)] = beta_series.split_trials(run["ev_files"][1], run["ev_dir"], "stop")
+    assert rest_file is None and onset == 5.0
+
+def read_evs(design_file):
+    """
+    Returns the EV titles of a design, in order.
+    """
+    with open(design_file) as file:
+        return [line.split('"')[1] for line in file if line.startswith("set fmri(evtitle")]
+
+def test_lss_gives_one_design_per_trial(run):
+    rows = beta_series.beta_series_fsf(**run, split_evs=["go"])
+
+    assert [row["trial"] for row in rows] == [1, 2, 3]
+    assert os.path.basename(os.path.dirname(rows[0]["design_file"])) == "go_trial-001"
+    assert read_evs(rows[0]["design_file"]) == ["trial", "go_rest", "stop"]
+
+def test_lsa_gives_one_ev_per_trial(run):
+    rows = beta_series.beta_series_fsf(**run, method="LSA")
+
+    assert len({row["design_file"] for row in rows}) == 1 and len(rows) == 4
+    assert read_evs(rows[0]["design_file"]) == ["go_trial-001", "go_trial-002", "go_trial-003", "stop_trial-001"]
+
+@pytest.mark.parametrize("options, message", [({"orthogonalise": [(2, 1)]}, "cannot be set"),
+                                              ({"contrasts": {"go": [1, 0]}}, "cannot be set"),
+                                              ({"high_pass_filtre": 90}, "not lowlvl_fsf options"),
+                                              ({"method": "LSX"}, "LSS or LSA"),
+                                              ({"split_evs": ["jump"]}, "not among the EV names")])
+def test_invalid_options_are_rejected(run, options, message):
+    with pytest.raises(ValueError, match=message):
+        beta_series.beta_series_fsf(**run, **options)
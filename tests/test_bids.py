@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from make_fsf import bids
+
+def test_discover_pairs_runs_with_task_events_and_confounds(bids_dataset):
+    runs = bids.discover_bids(str(bids_dataset), str(bids_dataset / "derivatives" / "fmriprep"))
+
+    assert sorted(runs) == ["sub-01_task-x_run-1", "sub-01_task-x_run-2"]
+    for run in runs.values():
+        assert run["events"] == str(bids_dataset / "task-x_events.tsv")
+    assert runs["sub-01_task-x_run-1"]["confounds"].endswith("_desc-confounds_timeseries.tsv")
+    assert runs["sub-01_task-x_run-2"]["confounds"] is None
+
+def test_discover_skips_derivatives(bids_dataset, make_nifti):
+    make_nifti(str(bids_dataset / "derivatives" / "fmriprep" / "sub-01" / "func" / "sub-01_task-y_bold.nii.gz"))
+    assert all("task-y" not in key for key in bids.discover_bids(str(bids_dataset)))
+
+def test_events_to_evs_groups_sorts_and_drops_missing_onsets(tmp_path, bids_dataset):
+    ev_files = bids.events_to_evs(str(bids_dataset / "task-x_events.tsv"), str(tmp_path / "evs"), prefix="run")
+
+    assert list(ev_files) == ["go", "stop"]
+    np.testing.assert_allclose(np.loadtxt(ev_files["go"], ndmin=2), [[0, 2, 1], [10, 2, 1]])
+    np.testing.assert_allclose(np.loadtxt(ev_files["stop"], ndmin=2), [[5, 1, 1]])
+
+def test_events_to_evs_numbers_clashing_names(tmp_path):
+    events = tmp_path / "sub-01_task-x_events.tsv"
+    events.write_text("onset\tduration\ttrial_type\n0\t1\tgo left\n5\t1\tgoleft\n")
+
+    ev_files = bids.events_to_evs(str(events), str(tmp_path / "evs"))
+
+    assert len(set(ev_files.values())) == 2
+    np.testing.assert_allclose(np.loadtxt(ev_files["go left"], ndmin=2), [[0, 1, 1]])
+    np.testing.assert_allclose(np.loadtxt(ev_files["goleft"], ndmin=2), [[5, 1, 1]])
+
+def test_read_tsv_rejects_an_empty_file(tmp_path):
+    empty = tmp_path / "empty.tsv"
+    empty.write_text("")
+    with pytest.raises(ValueError, match="empty"):
+        bids._read_tsv(str(empty))
+
+def test_confounds_to_txt_fills_missing_values(tmp_path):
+    confounds = tmp_path / "confounds.tsv"
+    confounds.write_text("a\tb\nn/a\t1\n2\t3\n")
+
+    output = bids.confounds_to_txt(str(confounds), str(tmp_path / "confounds.txt"), ["a", "b"])
+
+    np.testing.assert_allclose(np.loadtxt(output), [[0, 1], [2, 3]])
+
+def test_events_without_trial_type_are_one_condition(tmp_path):
+    events = tmp_path / "sub-01_task-x_events.tsv"
+    events.write_text("onset\tduration\n5\t1\n0\t1\n")
+
+    ev_files = bids.events_to_evs(str(events), str(tmp_path / "evs"))
+
+    assert list(ev_files) == [bids.DEFAULT_TRIAL_TYPE]
+    np.testing.assert_allclose(np.loadtxt(ev_files[bids.DEFAULT_TRIAL_TYPE], ndmin=2), [[0, 1, 1], [5, 1, 1]])
+
+def test_a_malformed_run_is_skipped(tmp_path, bids_dataset, capsys):
+    (bids_dataset / "sub-01" / "func" / "sub-01_task-x_run-2_events.tsv").write_text("onset\tduration\nsoon\t1\n")
+
+    jobs = list(bids.bids_jobs(str(bids_dataset), str(tmp_path / "fsfs"), str(tmp_path / "feats"),
+                               str(tmp_path / "evs"), fmriprep_dir=str(bids_dataset / "derivatives" / "fmriprep")))
+
+    assert [job["fsf_dir"] for job in jobs] == [str(tmp_path / "fsfs" / "sub-01_task-x_run-1")]
+    assert "skipping sub-01_task-x_run-2" in capsys.readouterr().out
@@ -0,0 +1,60 @@
+import os
+import pytest
+from make_fsf import bids
+from make_fsf import bundle
+from make_fsf import feat_functions
+
+def test_round_trip_keeps_the_latest_design(tmp_path):
+    bundle_file = str(tmp_path / "designs.sqlite")
+    connection = bundle.open_bundle(bundle_file)
+    try:
+        bundle.add_designs(connection, [("a/design.fsf", "first"), ("b/design.fsf", "other")])
+        bundle.add_designs(connection, [("a/design.fsf", "second")])
+    finally:
+        connection.close()
+
+    assert bundle.list_designs(bundle_file) == ["a/design.fsf", "b/design.fsf"]
+    design_file = bundle.extract_design(bundle_file, "a/design.fsf", str(tmp_path / "out" / "design.fsf"))
+    with open(design_file) as file:
+        assert file.read() == "second"
+    with pytest.raises(KeyError):
+        bundle.extract_design(bundle_file, "c/design.fsf")
+
+def test_bundling_creates_no_job_directories(tmp_path, bids_dataset):
+    jobs = list(bids.bids_jobs(str(bids_dataset), str(tmp_path / "fsfs"), str(tmp_path / "feats"),
+                               str(tmp_path / "evs"), create_fsf_dirs=False))
+    bundle_file = str(tmp_path / "designs.sqlite")
+
+    names = bundle.bundle_fsf(jobs, bundle_file)
+
+    assert not os.path.exists(tmp_path / "fsfs") and not os.path.exists(tmp_path / "feats")
+    assert not os.path.exists(bundle_file + "-wal")
+    extracted = bundle.extract_design(bundle_file, names[0])
+    with open(extracted) as file:
+        assert file.read() == feat_functions.render_lowlvl_fsf(**jobs[0], check_output_dir=False)
+
+def test_commits_reuse_one_journal_file(tmp_path):
+    bundle_file = str(tmp_path / "designs.sqlite")
+    journal = bundle_file + "-journal"
+    connection = bundle.open_bundle(bundle_file)
+    try:
+        bundle.add_designs(connection, [("a/design.fsf", "first")])
+        inode = os.stat(journal).st_ino
+        for n in range(5):
+            bundle.add_designs(connection, [(f"{n}/design.fsf", "more")])
+            assert os.stat(journal).st_ino == inode
+    finally:
+        connection.close()
+
+def test_bundling_commits_in_batches(tmp_path, bids_dataset, monkeypatch):
+    jobs = bids.bids_jobs(str(bids_dataset), str(tmp_path / "fsfs"), str(tmp_path / "feats"),
+                          str(tmp_path / "evs"), create_fsf_dirs=False)
+    commits = []
+    add_designs = bundle.add_designs
+    monkeypatch.setattr(bundle, "add_designs", lambda connection, designs: commits.append(len(designs))
+                        or add_designs(connection, designs))
+
+    names = bundle.bundle_fsf(jobs, str(tmp_path / "designs.sqlite"))
+
+    assert commits == [2]
+    assert bundle.list_designs(str(tmp_path / "designs.sqlite")) == sorted(names)
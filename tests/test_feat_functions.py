@@ -0,0 +1,69 @@
+import pytest
+from make_fsf import feat_functions
+
+# ----- design -----
+@pytest.fixture
+def design(tmp_path, make_nifti):
+    """
+    Writes two runs and an EV file, and returns the render_lowlvl_fsf arguments for both runs.
+    """
+    ev_file = tmp_path / "go.txt"
+    ev_file.write_text("0\t1\t1\n")
+    runs = [make_nifti(str(tmp_path / f"run-{run}.nii.gz")) for run in (1, 2)]
+    return {"fsf_dir": str(tmp_path),
+            "input_file": runs,
+            "output_dir": str(tmp_path),
+            "confound_file": None,
+            "tr": None,
+            "total_volumes": None,
+            "ev_files": [str(ev_file)],
+            "ev_names": ["go"],
+            "contrasts": {"go": [1]},
+            "prethresh_masking": None}
+
+def test_multiple_runs_are_listed(design):
+    fsf_content = feat_functions.render_lowlvl_fsf(**design)
+
+    assert "set fmri(multiple) 2" in fsf_content
+    assert "set fmri(tr) 2.0" in fsf_content
+    assert "set fmri(npts) 10" in fsf_content
+
+def test_runs_with_different_volumes_are_rejected(design, make_nifti):
+    make_nifti(design["input_file"][1], shape=(2, 2, 2, 12))
+    with pytest.raises(ValueError, match="do not share the same volumes"):
+        feat_functions.render_lowlvl_fsf(**design)
+
+def test_runs_with_different_trs_are_rejected(design, make_nifti):
+    make_nifti(design["input_file"][1], tr=3.0)
+    with pytest.raises(ValueError, match="do not share the same tr"):
+        feat_functions.render_lowlvl_fsf(**design)
+
+def test_trs_within_tolerance_agree(design, make_nifti):
+    make_nifti(design["input_file"][1], tr=2.0004)
+    assert "set fmri(tr) 2.0" in feat_functions.render_lowlvl_fsf(**design)
+
+def test_supplied_tr_overrides_an_unreadable_header(design, make_nifti):
+    make_nifti(design["input_file"][1], tr=0.0)
+    assert "set fmri(tr) 2.5" in feat_functions.render_lowlvl_fsf(**{**design, "tr": 2.5})
+
+def test_confound_count_must_match_runs(design, tmp_path):
+    confounds = tmp_path / "confounds.txt"
+    confounds.write_text("0\n")
+    with pytest.raises(ValueError, match="number of confound files"):
+        feat_functions.render_lowlvl_fsf(**{**design, "confound_file": [str(confounds)]})
+
+def test_one_confound_file_is_not_shared_across_runs(design, tmp_path):
+    confounds = tmp_path / "confounds.txt"
+    confounds.write_text("0\n")
+    with pytest.raises(ValueError, match="single confound file"):
+        feat_functions.render_lowlvl_fsf(**{**design, "confound_file": str(confounds)})
+
+def test_confounds_are_given_for_every_run_or_none(design, tmp_path):
+    confounds = tmp_path / "confounds.txt"
+    confounds.write_text("0\n")
+    with pytest.raises(ValueError, match="every input file or none"):
+        feat_functions.render_lowlvl_fsf(**{**design, "confound_file": [str(confounds), None]})
+
+    fsf_content = feat_functions.render_lowlvl_fsf(**{**design, "confound_file": [str(confounds)] * 2})
+    assert "set fmri(confoundevs) 1" in fsf_content
+    assert f'set confoundev_files(2) "{confounds}"' in fsf_content
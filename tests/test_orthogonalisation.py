@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from make_fsf import feat_functions
+
+def test_ortho_pairs_accept_names_and_numbers():
+    matrix = feat_functions._ortho_matrix([("b", "a"), (3, 1)], ["a", "b", "c"])
+    np.testing.assert_array_equal(matrix, [[0, 0, 0], [1, 0, 0], [1, 0, 0]])
+
+@pytest.mark.parametrize("orthogonalise, message", [
+    ([(1, 1)], "itself"),
+    ([(1, 2), (2, 1)], "circular"),
+    ([(1, 4)], "does not exist"),
+    ([(2.7, 1)], "must be an EV number or name"),
+    ([(True, 2)], "must be an EV number or name"),
+    ([(1, None)], "must be an EV number or name"),
+    ([("a", "zz")], "EV zz .* does not exist"),
+    ([(1, 2, 3)], "must hold two EVs"),
+    ([(1,)], "must hold two EVs"),
+    (np.zeros((2, 2)), "must be 3 x 3"),
+])
+def test_invalid_ortho_is_rejected(orthogonalise, message):
+    with pytest.raises(ValueError, match=message):
+        feat_functions._ortho_matrix(orthogonalise, ["a", "b", "c"])
+
+def test_ortho_entries_include_every_pair_and_ev_zero():
+    blocks = feat_functions._ortho_blocks(feat_functions._ortho_matrix([("b", "a")], ["a", "b"]))
+
+    assert len(blocks) == 2
+    assert "set fmri(ortho1.0) 0" in blocks[0] and "set fmri(ortho1.2) 0" in blocks[0]
+    assert "set fmri(ortho2.1) 1" in blocks[1] and "set fmri(ortho2.2) 0" in blocks[1]
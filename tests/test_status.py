@@ -0,0 +1,82 @@
+import json
+import os
+import time
+import pytest
+from make_fsf import status
+
+# ----- feat_job -----
+@pytest.fixture
+def feat_job(tmp_path):
+    """
+    Returns a function writing a design whose output directory is <tmp_path>/feats/<name>,
+    and optionally the .feat directory FEAT would have created for it.
+    """
+    def make(name, report=None, error=None, plus=""):
+        design_file = tmp_path / "fsfs" / name / "design.fsf"
+        design_file.parent.mkdir(parents=True, exist_ok=True)
+        design_file.write_text(f'set fmri(outputdir) "{tmp_path / "feats" / name}"\n')
+        if report is not None or error is not None:
+            feat_dir = tmp_path / "feats" / f"{name}{plus}.feat"
+            (feat_dir / "logs").mkdir(parents=True, exist_ok=True)
+            (feat_dir / "report_log.html").write_text("")
+            if report is not None:
+                (feat_dir / "report.html").write_text(report)
+                (feat_dir / status.COMPLETE_MARKER).write_text(report)
+            if error is not None:
+                (feat_dir / "logs" / "feat2_pre.e123").write_text(error)
+        return str(design_file)
+    return make
+
+def test_jobs_are_classified(feat_job):
+    assert status.job_status(feat_job("waiting"))["status"] == status.NOT_STARTED
+    assert status.job_status(feat_job("done", report="<html>Done</html>"))["status"] == status.COMPLETE
+    running = feat_job("running", report='<META HTTP-EQUIV="refresh" CONTENT="5">STILL RUNNING')
+    assert status.job_status(running)["status"] == status.RUNNING
+
+def test_errors_outrank_a_post_stats_report(feat_job):
+    design_file = feat_job("broken", report="<html>Done</html>", error="ERROR: could not open image")
+    assert status.job_status(design_file)["status"] == status.FAILED
+
+def test_the_latest_rerun_is_used(feat_job, tmp_path):
+    feat_job("rerun", report="<html>Done</html>", error="ERROR: first attempt")
+    design_file = feat_job("rerun", report="<html>Done</html>", plus="+")
+
+    record = status.job_status(design_file)
+
+    assert record["feat_dir"] == str(tmp_path / "feats" / "rerun+.feat")
+    assert record["status"] == status.COMPLETE
+
+def test_unchanged_unfinished_jobs_become_stale(feat_job, tmp_path):
+    design_file = feat_job("stuck", report="STILL RUNNING")
+    old = time.time() - 3600
+    for entry in os.scandir(tmp_path / "feats" / "stuck.feat"):
+        os.utime(entry.path, (old, old))
+
+    assert status.job_status(design_file, stale_after=60)["status"] == status.FAILED
+    assert status.job_status(design_file)["status"] == status.RUNNING
+
+def test_scan_skips_jobs_indexed_as_complete(feat_job, tmp_path, monkeypatch):
+    done = feat_job("done", report="<html>Done</html>")
+    waiting = feat_job("waiting")
+    index_file = str(tmp_path / "status.json")
+    status.scan_status(str(tmp_path / "fsfs"), index_file=index_file)
+
+    scanned = []
+    job_status = status.job_status
+    monkeypatch.setattr(status, "job_status", lambda design, stale_after=None: scanned.append(design)
+                        or job_status(design, stale_after))
+    index = status.scan_status(str(tmp_path / "fsfs"), index_file=index_file)
+
+    assert scanned == [waiting]
+    assert index[done]["status"] == status.COMPLETE
+    with open(index_file) as file:
+        assert json.load(file)[waiting]["status"] == status.NOT_STARTED
+
+def test_a_vanished_directory_does_not_abort_the_scan(feat_job, tmp_path, monkeypatch):
+    design_file = feat_job("gone", report="<html>Done</html>")
+    monkeypatch.setattr(status.os, "scandir", lambda path: (_ for _ in ()).throw(FileNotFoundError(path)))
+
+    index = status.scan_status([design_file], index_file=str(tmp_path / "status.json"))
+
+    assert index[design_file]["status"] == status.NOT_STARTED
+    assert os.path.exists(tmp_path / "status.json")
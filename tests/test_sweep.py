@@ -0,0 +1,52 @@
+import csv
+import os
+import pytest
+from make_fsf import bids
+from make_fsf import sweep
+
+def test_combinations_are_labelled_in_parameter_order():
+    combinations = sweep._sweep_combinations({"cluster_z": [2.3, 3.1], "high_pass_filter": [100],
+                                              "film_prewhitening": [False]})
+    assert [label for label, _ in combinations] == ["hp-100_z-2.3_pw-0", "hp-100_z-3.1_pw-0"]
+
+@pytest.mark.parametrize("grid, message", [({"tr": [2]}, "can be swept"), ({"cluster_z": []}, "empty")])
+def test_invalid_grids_are_rejected(grid, message):
+    with pytest.raises(ValueError, match=message):
+        sweep._sweep_combinations(grid)
+
+def test_sweep_writes_designs_and_manifest(tmp_path, bids_dataset):
+    jobs = bids.bids_jobs(str(bids_dataset), str(tmp_path / "fsfs"), str(tmp_path / "feats"), str(tmp_path / "evs"))
+    manifest = tmp_path / "manifest.tsv"
+
+    rows = sweep.sweep_fsf(jobs, {"cluster_z": [2.3, 3.1], "thresholding": ["Voxel"]}, str(manifest))
+
+    assert len(rows) == 4
+    with open(manifest, newline="") as file:
+        written = list(csv.DictReader(file, delimiter="\t"))
+    assert [row["design_file"] for row in written] == [row["design_file"] for row in rows]
+
+    row = written[0]
+    assert row["cluster_z"] == "2.3" and row["thresholding"] == "Voxel" and row["high_pass_filter"] == "100"
+    with open(row["design_file"]) as file:
+        fsf_content = file.read()
+    assert "set fmri(z_thresh) 2.3" in fsf_content
+    assert "set fmri(thresh) 2" in fsf_content
+    assert f'set fmri(outputdir) "{row["output_dir"]}"' in fsf_content
+    assert os.path.basename(row["output_dir"]) == "z-2.3_thresh-Voxel"
+
+def test_invalid_grid_values_are_rejected_before_anything_is_written(tmp_path, bids_dataset):
+    jobs = bids.bids_jobs(str(bids_dataset), str(tmp_path / "fsfs"), str(tmp_path / "feats"), str(tmp_path / "evs"))
+    with pytest.raises(ValueError, match="Thresholding must be one of"):
+        sweep.sweep_fsf(jobs, {"thresholding": ["Cluster", "bogus"]}, str(tmp_path / "manifest.tsv"))
+    assert not (tmp_path / "fsfs").exists()
+
+@pytest.mark.parametrize("grid", [{"cluster_p": [0.05, "0.05"]},
+                                  {"thresholding": ["Cluster", 3]},
+                                  {"film_prewhitening": [True, 1]}])
+def test_two_spellings_of_one_value_are_rejected(grid):
+    with pytest.raises(ValueError, match="give the same design"):
+        sweep._sweep_combinations(grid)
+
+def test_negative_values_keep_their_sign():
+    labels = [label for label, _ in sweep._sweep_combinations({"high_pass_filter": [-1, 1]})]
+    assert labels == ["hp--1", "hp-1"]
@@ -0,0 +1,64 @@
+import json
+import nibabel as nib
+import numpy as np
+import pytest
+from make_fsf import utilities
+
+def test_sidecars_are_inherited_up_to_the_dataset_root(bids_dataset):
+    utilities.clear_caches()
+    bold = bids_dataset / "sub-01" / "func" / "sub-01_task-x_run-1_bold.nii.gz"
+    (bids_dataset / "sub-01" / "func" / "sub-01_task-x_run-1_bold.json").write_text(json.dumps({"SliceTiming": [0]}))
+
+    metadata = utilities.sidecar_metadata(str(bold))
+
+    assert metadata == {"RepetitionTime": 2.0, "SliceTiming": [0]}
+
+def test_sidecars_outside_a_dataset_come_from_the_file_directory_only(tmp_path, make_nifti, monkeypatch):
+    utilities.clear_caches()
+    (tmp_path / "task-x_bold.json").write_text(json.dumps({"RepetitionTime": 9.0}))
+    bold = make_nifti(str(tmp_path / "data" / "sub-01_task-x_bold.nii.gz"), tr=2.0)
+    (tmp_path / "data" / "task-x_bold.json").write_text(json.dumps({"RepetitionTime": 1.5}))
+
+    parsed = []
+    directory_sidecars = utilities._directory_sidecars.__wrapped__
+    monkeypatch.setattr(utilities, "_directory_sidecars", lambda directory, generation=0: parsed.append(directory)
+                        or directory_sidecars(directory, generation))
+
+    assert utilities.resolve_tr(bold) == 1.5
+    assert parsed == [str(tmp_path / "data")]
+
+def test_resolve_tr_falls_back_to_the_header(tmp_path, make_nifti):
+    utilities.clear_caches()
+    bold = make_nifti(str(tmp_path / "sub-01_task-x_bold.nii.gz"), tr=2.5)
+    assert utilities.resolve_tr(bold) == 2.5
+
+@pytest.mark.parametrize("extension", [".nii", ".nii.gz"])
+def test_leading_bright_volumes_are_counted_as_dummies(tmp_path, extension):
+    data = np.random.default_rng(0).normal(100, 1, (3, 3, 3, 30)).astype(np.float32)
+    data[..., :3] += 50
+    path = str(tmp_path / f"bold{extension}")
+    nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+
+    assert utilities.dummies_from_nifti(path) == 3
+    volumes = list(utilities._iter_volumes(path, 2))
+    np.testing.assert_allclose(volumes[1], data[..., 1].ravel(order="F"), rtol=1e-6)
+
+def test_a_3d_image_has_no_dummies(tmp_path, make_nifti):
+    path = make_nifti(str(tmp_path / "anat.nii.gz"), shape=(4, 4, 4))
+    assert list(utilities._iter_volumes(path)) == []
+    assert utilities.dummies_from_nifti(path) == 0
+
+def test_a_probe_racing_with_clear_caches_is_not_reused(tmp_path, make_nifti, monkeypatch):
+    utilities.clear_caches()
+    bold = make_nifti(str(tmp_path / "sub-01_task-x_bold.nii.gz"), tr=2.0)
+    tr_from_sidecar = utilities.tr_from_sidecar
+
+    # The sidecar is edited (and the caches cleared) while the first probe is reading it
+    def racing(input_file):
+        utilities.clear_caches()
+        return 3.0
+    monkeypatch.setattr(utilities, "tr_from_sidecar", racing)
+    assert utilities.probe_nifti(bold)["tr"] == 3.0
+
+    monkeypatch.setattr(utilities, "tr_from_sidecar", tr_from_sidecar)
+    assert utilities.probe_nifti(bold)["tr"] == 2.0
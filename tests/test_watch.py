@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from make_fsf import watch
+
+# ----- replace -----
+def replace(path, text):
+    """
+    Rewrites a file through a temporary file, as copying tools do.
+    """
+    temporary = f"{path}.part"
+    with open(temporary, "w") as file:
+        file.write(text)
+    os.replace(temporary, path)
+
+# ----- wait_for -----
+def wait_for(condition, timeout=10.0):
+    """
+    Waits until a condition holds, returning whether it did.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+def test_incremental_snapshots_see_new_files(bids_dataset):
+    directories = {}
+    files = watch._snapshot(str(bids_dataset), None, directories)
+    new_events = bids_dataset / "sub-01" / "func" / "sub-01_task-x_run-1_events.tsv"
+    replace(new_events, "onset\tduration\ttrial_type\n0\t1\tgo\n")
+
+    current = watch._snapshot(str(bids_dataset), None, directories, full=False)
+
+    assert set(current) - set(files) == {str(new_events)}
+
+def test_in_place_rewrites_are_seen_by_full_listings(bids_dataset):
+    directories = {}
+    events = str(bids_dataset / "task-x_events.tsv")
+    files = watch._snapshot(str(bids_dataset), None, directories)
+    with open(events, "a") as file:
+        file.write("30\t1\tgo\n")
+
+    assert watch._snapshot(str(bids_dataset), None, directories, full=True)[events] != files[events]
+
+def test_sidecars_affect_every_run_beneath_them(bids_dataset):
+    runs = watch._runs_from_snapshot(watch._snapshot(str(bids_dataset)))
+
+    assert watch._affected_runs({str(bids_dataset / "task-x_bold.json")}, runs) == set(runs)
+    bold = runs["sub-01_task-x_run-2"]["bold"]
+    assert watch._affected_runs({bold}, runs) == {"sub-01_task-x_run-2"}
+
+def test_changed_runs_are_regenerated_one_thread_at_a_time(tmp_path, bids_dataset, monkeypatch):
+    active = {}
+    regenerated = []
+    overlaps = []
+    lock = threading.Lock()
+
+    def lowlvl_fsf(**job):
+        with lock:
+            active[job["fsf_dir"]] = active.get(job["fsf_dir"], 0) + 1
+            if active[job["fsf_dir"]] > 1:
+                overlaps.append(job["fsf_dir"])
+        time.sleep(0.3)
+        with lock:
+            active[job["fsf_dir"]] -= 1
+            regenerated.append(job["fsf_dir"])
+    monkeypatch.setattr(watch.feat_functions, "lowlvl_fsf", lowlvl_fsf)
+
+    stop_event = threading.Event()
+    thread = threading.Thread(target=watch.watch_bids,
+                              args=(str(bids_dataset), str(tmp_path / "fsfs"), str(tmp_path / "feats"),
+                                    str(tmp_path / "evs")),
+                              kwargs={"poll_interval": 0.02, "debounce": 0.05, "n_workers": 4,
+                                      "stop_event": stop_event})
+    thread.start()
+    try:
+        # Letting the watcher take its first snapshot before anything changes
+        time.sleep(0.5)
+        events = bids_dataset / "sub-01" / "func" / "sub-01_task-x_run-1_events.tsv"
+        replace(events, "onset\tduration\ttrial_type\n0\t1\tgo\n")
+        assert wait_for(lambda: active.get(str(tmp_path / "fsfs" / "sub-01_task-x_run-1")))
+
+        # Changing the run again while it is being regenerated queues it once more
+        replace(events, "onset\tduration\ttrial_type\n0\t1\tgo\n5\t1\tstop\n")
+        assert wait_for(lambda: len(regenerated) >= 2)
+    finally:
+        stop_event.set()
+        thread.join()
+
+    assert set(regenerated) == {str(tmp_path / "fsfs" / "sub-01_task-x_run-1")}
+    assert overlaps == []